@@ -0,0 +1,305 @@
+"""Asyncio (ASGI) serving mode for the SecretStroll API.
+
+The application exposes the same routes as the Flask application of
+`server.py`. The event loop only parses requests and writes responses: the
+cryptography runs in executor threads (which may hand it over to the batch
+verifier or the worker pool), and the PoIs are served from the in-memory
+index of `poi_index.py`, so that slow clients holding their connection open
+do not take verification capacity away.
+
+The application is served with uvicorn, which is only needed for this mode.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import json
+import random
+from urllib.parse import parse_qs
+
+from metrics import METRICS
+from workers import PoolBusyError
+
+# Errors of an overloaded worker pool, answered with 503.
+BUSY_ERRORS = (PoolBusyError, concurrent.futures.TimeoutError)
+
+
+class AsyncApp:
+    """ASGI application serving the SecretStroll API."""
+
+    def __init__(self, server_pk, register_user, check_request_signature, poi_index, crypto_threads=None,
+                 register_users=None, max_register_batch=1024, max_poi_batch=256, max_body=16 * 1024 * 1024):
+        """Create the application.
+
+        Args:
+            server_pk (byte[]): the server's public key (serialized)
+            register_user (function): blocking function behaving as
+                Server.register with the server's secret key
+            check_request_signature (function): blocking function behaving
+                as Server.check_request_signature with the server's public key
+            poi_index (poi_index.PoIIndex): the PoI index
+            crypto_threads (int): the number of executor threads running the
+                blocking functions
+            register_users (function): blocking function behaving as
+                Server.register_many with the server's secret key, which
+                enables /register-batch
+            max_register_batch (int): the maximal number of registrations of
+                a /register-batch request
+            max_poi_batch (int): the maximal number of PoIs of a /pois
+                request
+            max_body (int): the maximal size of a request body, in bytes,
+                larger bodies are answered with 413
+        """
+        self.server_pk = server_pk
+        self.register_user = register_user
+        self.register_users = register_users
+        self.max_register_batch = max_register_batch
+        self.max_poi_batch = max_poi_batch
+        self.max_body = max_body
+        self.check_request_signature = check_request_signature
+        self.poi_index = poi_index
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=crypto_threads)
+        self.routes = {
+            ("GET", "/public-key"): self.get_public_key,
+            ("POST", "/register"): self.register,
+            ("POST", "/register-batch"): self.register_batch,
+            ("GET", "/poi-loc"): self.get_poi_loc,
+            ("GET", "/poi-grid"): self.get_poi_list,
+            ("GET", "/poi"): self.get_poi_info,
+            ("GET", "/pois"): self.get_pois_info,
+            ("GET", "/metrics"): self.get_metrics,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        route = self.routes.get((scope["method"], scope["path"]))
+        if route is None:
+            status, body, content_type = self._text(404, "Not found")
+        else:
+            query = parse_qs(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+            params = {key: values[0] for key, values in query.items()}
+            body = await self._read_body(receive, self.max_body) if scope["method"] == "POST" else b""
+            if body is None:
+                status, body, content_type = self._text(413, "Request entity too large")
+            else:
+                try:
+                    with METRICS.request(scope["path"].lstrip("/")):
+                        status, body, content_type = await route(params, body)
+                except BUSY_ERRORS:
+                    status, body, content_type = self._text(503, "Server busy")
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type.encode("latin-1")),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _read_body(receive, max_size):
+        # Return None as soon as the body is larger than max_size.
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > max_size:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _crypto(self, fn, *args):
+        # Executors do not propagate context variables, which hold the labels
+        # of the request for the metrics.
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    @staticmethod
+    def _text(status, text):
+        return status, text.encode("utf-8"), "text/html; charset=utf-8"
+
+    @staticmethod
+    def _param(params, name, type_=str):
+        # As request.args.get(name, type=type_) in Flask: None when the
+        # parameter is missing or cannot be converted.
+        try:
+            return type_(params[name])
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def _json(obj):
+        return 200, (json.dumps(obj) + "\n").encode("utf-8"), "application/json"
+
+    async def get_metrics(self, params, body):
+        """Export the phase timings in the Prometheus text format, if enabled."""
+        if not METRICS.enabled:
+            return self._text(404, "Not found")
+
+        return 200, METRICS.render().encode("utf-8"), "text/plain; version=0.0.4"
+
+    async def get_public_key(self, params, body):
+        """Handle requests for public key."""
+        return 200, self.server_pk, "text/html; charset=utf-8"
+
+    async def register(self, params, body):
+        """Handle registrations."""
+        issuance_req = params.get("issuance_req")
+        username = params.get("username")
+        attributes = params.get("attributes")
+        if None in (username, attributes, issuance_req):
+            return self._text(400, "Bad request")
+
+        anon_cred = await self._crypto(self.register_user, issuance_req, username, attributes)
+        return 200, anon_cred, "text/html; charset=utf-8"
+
+    async def register_batch(self, params, body):
+        """Handle many registrations at once, as the Flask application."""
+        if self.register_users is None:
+            return self._text(404, "Not found")
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return self._text(400, "Bad request")
+        requests = data.get("requests") if isinstance(data, dict) else None
+        if not isinstance(requests, list):
+            return self._text(400, "Bad request")
+        if len(requests) > self.max_register_batch:
+            return self._text(413, "Too many registrations")
+
+        try:
+            items = [(req["issuance_req"], req["username"], req["attributes"]) for req in requests]
+        except (KeyError, TypeError):
+            return self._text(400, "Bad request")
+
+        anon_creds = await self._crypto(self.register_users, items)
+        responses = []
+        for anon_cred in anon_creds:
+            if anon_cred:
+                responses.append({"response": anon_cred.decode("utf-8")})
+            else:
+                responses.append({"error": "Registration failed"})
+
+        return self._json({"responses": responses})
+
+    async def get_poi_loc(self, params, body):
+        """Takes in a latitude and longitude as input, returns a list of associated POIs."""
+        lat = self._param(params, "lat", float)
+        lon = self._param(params, "lon", float)
+        attrs_revealed = params.get("attrs_revealed")
+        signature = params.get("signature")
+        if None in (lat, lon, attrs_revealed, signature):
+            return self._text(400, "Bad request")
+
+        message = ("{},{}".format(lat, lon)).encode("utf-8")
+        if not await self._crypto(self.check_request_signature, message, attrs_revealed, signature):
+            return self._text(401, "Invalid signature")
+
+        # PoIs are within coordinates (46.5, 6.55) and (46.57, 6.65)
+        # mapped to a 10 x 10 grid
+        poi_list = []
+        if 46.5 <= lat <= 46.57 and 6.55 <= lon <= 6.65:
+            cell_x = ((lat - 46.5) / 0.07) * 10
+            cell_y = ((lon - 6.55) / 0.1) * 10
+            cell_id = int(cell_x + (cell_y * 10))
+            with METRICS.phase("db"):
+                poi_list = self.poi_index.poi_ids(cell_id)
+
+        return self._json({"poi_list": poi_list})
+
+    async def get_poi_list(self, params, body):
+        """Takes in a cell ID as input, returns a list of associated POIs."""
+        cell_id = self._param(params, "cell_id", int)
+        attrs_revealed = params.get("attrs_revealed")
+        signature = params.get("signature")
+        if None in (cell_id, attrs_revealed, signature):
+            return self._text(400, "Bad request")
+
+        message = ("{}".format(cell_id)).encode("utf-8")
+        if not await self._crypto(self.check_request_signature, message, attrs_revealed, signature):
+            return self._text(401, "Invalid signature")
+
+        with METRICS.phase("db"):
+            poi_list = self.poi_index.poi_ids(cell_id)
+        if not poi_list:
+            return self._text(404, "Not found")
+
+        return self._json({"poi_list": poi_list})
+
+    async def get_poi_info(self, params, body):
+        """Takes in a PoI ID as input, returns information about that PoI.
+
+        The padding noise is the same as in the Flask application.
+        """
+        poi_id = self._param(params, "poi_id", int)
+        if poi_id is None:
+            return self._text(400, "Bad request")
+
+        noise_factor = 10
+
+        with METRICS.phase("db"):
+            poi_info = self.poi_index.poi(poi_id)
+        if poi_info is None:
+            return self._text(404, "Not found")
+
+        random_length = random.randint(0, noise_factor)
+        poi_info["padding"] = [-1 for x in range(0, random_length)]
+
+        return self._json(poi_info)
+
+    async def get_pois_info(self, params, body):
+        """Takes in a comma-separated list of PoI IDs as input, returns information about all these PoIs.
+
+        Every record is padded as in get_poi_info, and the record of a PoI that does not exist is null.
+        """
+        try:
+            poi_ids = [int(poi_id) for poi_id in params.get("poi_ids", "").split(",")]
+        except ValueError:
+            return self._text(400, "Bad request")
+        if len(poi_ids) > self.max_poi_batch:
+            return self._text(413, "Too many PoIs")
+
+        noise_factor = 10
+
+        pois = []
+        for poi_id in poi_ids:
+            with METRICS.phase("db"):
+                poi_info = self.poi_index.poi(poi_id)
+            if poi_info is not None:
+                random_length = random.randint(0, noise_factor)
+                poi_info["padding"] = [-1 for x in range(0, random_length)]
+            pois.append(poi_info)
+
+        return self._json({"pois": pois})
+
+
+def serve(app, host, port):
+    """Serve an ASGI application with uvicorn."""
+    try:
+        import uvicorn  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise SystemExit("The asynchronous mode needs uvicorn (pip install uvicorn).") from None
+
+    uvicorn.run(app, host=host, port=port, log_level="warning")
@@ -1,39 +1,43 @@
 import time
-from statistics import mean, stdev
+from statistics import mean
 import string
 import random
+from petrelic.multiplicative.pairing import G1, G2, GT
+from multiexp import multiexp, pippenger, straus
+from crypto import SecretKey, PublicKey, Signature
+from petrelic.bn import Bn
+import wire
 from your_code import Server, Client
 from os import path, mkdir
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import io
 import json
+import socket
+import socketserver
+import tempfile
+import threading
+import requests
+import client as client_cli
+from harness import measure, percentile
+from opcount import operation_counts
 
 
-def benchmark(func, it=10000, keep_res=False):
+def benchmark(func, it=10000, keep_res=False, count_ops=False):
     """"
-    This function runs a basic benchmark on the function passed as argument. It should be called with a lambda function,
-    e.g., benchmark(lambda: 4+4, 300).
+    This function runs a benchmark on the function passed as argument, with harness.measure. It should be called with
+    a lambda function, e.g., benchmark(lambda: 4+4, 300).
     :param keep_res: Indicates if the intermediary results should be kept.
     :param func: The (anonymous) function that is benchmark
-    :param it: The number of iteration.
-    :return: A dict that contains the mean, the standard deviation, the min and the max (in seconds)
+    :param it: The number of iteration, or None to calibrate it.
+    :param count_ops: Indicates if the group operations of one more call should be counted, see opcount.
+    :return: A dict that contains the mean, the standard deviation, the min, the max, the median, the 90th and 99th
+        percentiles and a 95% confidence interval of the mean (in seconds), and the operation counts under "ops"
 
     """
-    res = {}
-    results = []
-
-    for i in range(it):
-        start = time.time()
-        func()
-        end = time.time()
-        results.append(end - start)
-
-    res["mean"] = mean(results)
-    res["std"] = stdev(results)
-    res["min"] = min(results)
-    res["max"] = max(results)
-
-    if keep_res:
-        res["results"] = results
-
+    res = measure(func, it, keep_res)
+    if count_ops:
+        res["ops"] = operation_counts(func)
     return res
 
 
@@ -281,10 +285,328 @@ def benchmark_check_request_signature(nbrs_attr, it=10000):
         json.dump(benchmarks, json_file)
 
 
+def naive_multiexp(group, bases, exps):
+    """"
+    Product of exponentiations with one independent exponentiation per base, as done before multiexp.
+    """
+    acc = group.neutral_element()
+    for i in range(len(bases)):
+        acc = acc * bases[i] ** exps[i]
+    return acc
+
+
+def benchmark_multiexp(nbrs_bases, it=100):
+    """"
+    Compares multiexp, and the Straus and Pippenger methods it picks from, against one native exponentiation per base
+    in G1, G2 and GT and save the result in ./benchmark/multiexp.json. The number of bases from which "pippenger" beats
+    "straus" is the value of multiexp.PIPPENGER_THRESHOLD for this machine.
+    :param nbrs_bases: list containing the number of bases for each round of the benchmark
+    :param it: the number of iteration
+    """
+    print("========== multiexp ==========")
+    benchmarks = {}
+    for name, group in [("G1", G1), ("G2", G2), ("GT", GT)]:
+        print("# benchmarking {}...".format(name))
+        generator = group.generator() if name != "GT" else G1.generator().pair(G2.generator())
+        benchmarks[name] = {}
+        for nbr_bases in nbrs_bases:
+            bases = [generator ** group.order().random() for i in range(nbr_bases)]
+            exps = [group.order().random() for i in range(nbr_bases)]
+            scalars = [int(exp) for exp in exps]
+            benchmarks[name][nbr_bases] = {
+                "naive": benchmark(lambda: naive_multiexp(group, bases, exps), it),
+                "multiexp": benchmark(lambda: multiexp(group, bases, exps), it),
+                "straus": benchmark(lambda: straus(bases, scalars), it),
+                "pippenger": benchmark(lambda: pippenger(bases, scalars), it),
+            }
+
+    print("# benchmarks done, saving...")
+    mkdir_benchmark_folder()
+    with open("benchmark/multiexp.json", "w") as json_file:
+        json.dump(benchmarks, json_file)
+
+
+def benchmark_wire_format(nbrs_attr, it=1000):
+    """"
+    Compares the size and the encoding and decoding time of the binary codec against jsonpickle, and save the result
+    in ./benchmark/wire_format.json
+    :param nbrs_attr: list containing the number of attributes of the key for each round of the benchmark
+    :param it: the number of iteration
+    """
+    print("========== wire format ==========")
+    benchmarks = {}
+    for nbr_attr in nbrs_attr:
+        print("# generating ca and inputs for {} attributes...".format(nbr_attr))
+        attrs = [random_attr(5) for i in range(nbr_attr)]
+        server_pk, server_sk = Server.generate_ca(",".join(attrs))
+        client = Client()
+        server = Server()
+
+        client_attrs = ",".join(attrs[:nbr_attr // 2])
+        issuance_request, state = client.prepare_registration(server_pk, "bob", client_attrs)
+        issuance_response = server.register(server_sk, issuance_request, "bob", client_attrs)
+        anon_cred = client.proceed_registration_response(server_pk, issuance_response, state)
+        signature = client.sign_request(server_pk, anon_cred, "HALLO".encode("utf8"), "")
+
+        objects = {
+            "PublicKey": server_pk,
+            "SecretKey": server_sk,
+            "IssuanceRequest": issuance_request,
+            "IssuanceResponse": issuance_response,
+            "Credential": anon_cred,
+            "RequestSignature": signature,
+        }
+
+        print("# benchmarking...")
+        benchmarks[nbr_attr] = {}
+        for name, data in objects.items():
+            obj = wire.loads(data)
+            benchmarks[nbr_attr][name] = {}
+            for codec in [wire.JSON, wire.BINARY]:
+                encoded = wire.dumps(obj, codec)
+                benchmarks[nbr_attr][name][codec] = {
+                    "size": len(encoded),
+                    "encode": benchmark(lambda: wire.dumps(obj, codec), it),
+                    "decode": benchmark(lambda: wire.loads(encoded), it),
+                }
+            benchmarks[nbr_attr][name]["raw_binary_size"] = len(wire.encode(obj))
+
+    print("# benchmarks done, saving...")
+    mkdir_benchmark_folder()
+    with open("benchmark/wire_format.json", "w") as json_file:
+        json.dump(benchmarks, json_file)
+
+
+def naive_signature_verify(sig, pk, messages):
+    """"
+    Signature.verify as done before multiexp: one G2 exponentiation per message. Both versions compute two pairings.
+    """
+    if sig.sigma1 == G1.neutral_element():
+        return False
+
+    if len(messages) != len(pk.Y2):
+        return False
+
+    acc = pk.X2
+    for i in range(len(messages)):
+        acc = acc * (pk.Y2[i] ** messages[i])
+
+    return sig.sigma1.pair(acc) == sig.sigma2.pair(G2.generator())
+
+
+def benchmark_signature_verify(nbrs_attr, it=100):
+    """"
+    Compares Signature.verify against the previous method, on credentials with a secret key and binary attributes,
+    and save the result in ./benchmark/signature_verify.json
+    :param nbrs_attr: list containing the number of attributes of the key for each round of the benchmark
+    :param it: the number of iteration
+    """
+    print("========== signature verify ==========")
+    benchmarks = {}
+    for nbr_attr in nbrs_attr:
+        print("# generating key and signature for {} attributes...".format(nbr_attr))
+        sk = SecretKey.generate_random(["secret_key"] + [random_attr(5) for i in range(nbr_attr)])
+        pk = PublicKey.from_secret_key(sk)
+
+        messages = [G1.order().random()] + [Bn.from_num(random.randint(0, 1)) for i in range(nbr_attr)]
+        exp = sk.x
+        for y, m in zip(sk.y, messages):
+            exp = exp.mod_add(y * m, G1.order())
+        sigma1 = G1.generator() ** G1.order().random()
+        sig = Signature(sigma1, sigma1 ** exp)
+        assert sig.verify(pk, messages) and naive_signature_verify(sig, pk, messages)
+
+        print("# benchmarking...")
+        benchmarks[nbr_attr] = {
+            "naive": benchmark(lambda: naive_signature_verify(sig, pk, messages), it, count_ops=True),
+            "verify": benchmark(lambda: sig.verify(pk, messages), it, count_ops=True),
+        }
+
+    print("# benchmarks done, saving...")
+    mkdir_benchmark_folder()
+    with open("benchmark/signature_verify.json", "w") as json_file:
+        json.dump(benchmarks, json_file)
+
+
+def benchmark_server_load(hosts, attributes="a,b,c", nbr_requests=500, concurrency=32):
+    """"
+    Load test of running servers (e.g. `server.py run` and `server.py run --async`), and save the throughput and the
+    latency percentiles of signed /poi-grid requests in ./benchmark/server_load.json
+    The signatures are computed before the load starts, so that only the server is measured.
+    :param hosts: dict mapping a name to the host:port of a running server
+    :param attributes: the attributes to register with, which must be valid for every server
+    :param nbr_requests: the number of requests sent to each server
+    :param concurrency: the number of requests in flight at once
+    """
+    print("========== server load ==========")
+    client = Client()
+    benchmarks = {}
+    for name, host in hosts.items():
+        print("# registering to {}...".format(name))
+        session = requests.session()
+        server_pk = session.get("http://{}/public-key".format(host)).content
+        issuance_req, state = client.prepare_registration(server_pk, "bob", attributes)
+        params = {"username": "bob", "attributes": attributes, "issuance_req": issuance_req}
+        res = session.post("http://{}/register".format(host), params=params)
+        anon_cred = client.proceed_registration_response(server_pk, res.content, state)
+
+        print("# signing requests...")
+        queries = []
+        for i in range(nbr_requests):
+            cell_id = random.randint(1, 100)
+            message = ("{}".format(cell_id)).encode("utf-8")
+            signature = client.sign_request(server_pk, anon_cred, message, "")
+            queries.append({"cell_id": cell_id, "attrs_revealed": "", "signature": signature})
+
+        def send(params):
+            start = time.perf_counter()
+            res = requests.get("http://{}/poi-grid".format(host), params=params)
+            return time.perf_counter() - start, res.status_code
+
+        print("# benchmarking...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, queries))
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for latency, _ in results]
+        benchmarks[name] = {
+            "requests": nbr_requests,
+            "concurrency": concurrency,
+            "errors": sum(1 for _, status in results if status not in (200, 404)),
+            "rps": nbr_requests / elapsed,
+            "mean": mean(latencies),
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+        }
+        print("# {}: {:.1f} req/s, p99 {:.3f} s".format(name, benchmarks[name]["rps"], benchmarks[name]["p99"]))
+
+    print("# benchmarks done, saving...")
+    mkdir_benchmark_folder()
+    with open("benchmark/server_load.json", "w") as json_file:
+        json.dump(benchmarks, json_file)
+
+
+class LatencyProxy:
+    """"
+    Local TCP proxy that delays every chunk of data by half a round trip in each direction, to simulate the latency
+    of a Tor circuit.
+    """
+
+    def __init__(self, target_host, target_port, rtt=0.3):
+        """"
+        Start the proxy on a free local port.
+        :param target_host: the host to forward the connections to
+        :param target_port: the port to forward the connections to
+        :param rtt: the simulated round-trip time, in seconds
+        """
+        proxy = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                upstream = socket.create_connection((target_host, target_port))
+                forward = threading.Thread(target=proxy._pump, args=(self.request, upstream), daemon=True)
+                forward.start()
+                proxy._pump(upstream, self.request)
+                forward.join()
+                upstream.close()
+
+        self.delay = rtt / 2
+        self.server = socketserver.ThreadingTCPServer(("localhost", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _pump(self, source, destination):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                time.sleep(self.delay)
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            with contextlib.suppress(OSError):
+                destination.shutdown(socket.SHUT_WR)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def benchmark_client_commands(cell_ids, host="localhost", port=8080, rtt=0.3, it=10, concurrency=8):
+    """"
+    Measures the latency of the `client.py grid` command through a simulated-latency proxy, with the batched /pois
+    request and with one /poi request per PoI, sequential or concurrent, and save the result in
+    ./benchmark/client_commands.json
+    The server must be running on host:port, with a PoI database.
+    :param cell_ids: list of the cells queried for each round of the benchmark
+    :param host: the host of the server
+    :param port: the port of the server
+    :param rtt: the simulated round-trip time, in seconds
+    :param it: the number of iteration
+    :param concurrency: the number of concurrent /poi requests
+    """
+    print("========== client commands ==========")
+    print("# registering...")
+    session = requests.session()
+    server_pk = session.get("http://{}:{}/public-key".format(host, port)).content
+    attributes = ",".join(wire.loads(server_pk).valid_attributes[1:2])
+    client = Client()
+    issuance_req, state = client.prepare_registration(server_pk, "bob", attributes)
+    params = {"username": "bob", "attributes": attributes, "issuance_req": issuance_req}
+    res = session.post("http://{}:{}/register".format(host, port), params=params)
+    anon_cred = client.proceed_registration_response(server_pk, res.content, state)
+
+    folder = tempfile.mkdtemp()
+    pk_path = path.join(folder, "key.pub")
+    cred_path = path.join(folder, "anon.cred")
+    with open(pk_path, "wb") as pk_file:
+        pk_file.write(server_pk)
+    with open(cred_path, "wb") as cred_file:
+        cred_file.write(anon_cred)
+
+    proxy = LatencyProxy(host, port, rtt)
+    client_cli.SERVER_HOSTNAME = "localhost"
+    client_cli.SERVER_PORT = proxy.port
+
+    def run(cell_id, *options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            client_cli.main(["grid", "-p", pk_path, "-c", cred_path, "-r", "", *options, str(cell_id)])
+
+    print("# benchmarking...")
+    benchmarks = {}
+    for cell_id in cell_ids:
+        nbr_pois = len(requests.get("http://{}:{}/poi-grid".format(host, port), params={
+            "cell_id": cell_id,
+            "attrs_revealed": "",
+            "signature": client.sign_request(server_pk, anon_cred, str(cell_id).encode("utf-8"), ""),
+        }).json()["poi_list"])
+        benchmarks[cell_id] = {
+            "pois": nbr_pois,
+            "batch": benchmark(lambda: run(cell_id), it),
+            "per_poi": benchmark(lambda: run(cell_id, "--no-batch"), it),
+            "per_poi_concurrent": benchmark(lambda: run(cell_id, "--no-batch", "-k", str(concurrency)), it),
+        }
+    proxy.close()
+
+    print("# benchmarks done, saving...")
+    mkdir_benchmark_folder()
+    with open("benchmark/client_commands.json", "w") as json_file:
+        json.dump(benchmarks, json_file)
+
+
 if __name__ == '__main__':
     nbrs_attr = [i * 10 for i in range(10)]
     # benchmark_gen_ca(nbrs_attr, 100)
     # benchmark_prepare_registration(nbrs_attr, 100)
     # benchmark_register(nbrs_attr, 100)
     # benchmark_proceed_registration_response(nbrs_attr,100)
+    # benchmark_multiexp([1, 2, 4, 8, 16, 32, 64, 128], 100)
+    # benchmark_wire_format([1, 10, 100], 1000)
+    # benchmark_signature_verify([0, 10, 100, 1000], 100)
+    # benchmark_server_load({"flask": "localhost:8080", "async": "localhost:8081"})
+    # benchmark_client_commands([1, 42, 77], rtt=0.3, it=10)
     benchmark_check_request_signature(list(range(3)), 2)
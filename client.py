@@ -7,8 +7,10 @@ Client entrypoint.
 
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from your_code import Client
 
@@ -18,9 +20,13 @@ from your_code import Client
 
 
 SERVER_HOSTNAME = "cs523-server"
+SERVER_PORT = 8080
 TOR_PROXY = "socks5h://localhost:9050"
 TOR_HOSTNAME_FILENAME = "/client/tor/hidden_service/hostname"
 
+# Maximal number of PoIs of a /pois request, as accepted by server.py.
+MAX_POI_BATCH = 256
+
 
 class SimpleHTTPError(Exception):
     """An unexpected HTTP status was received."""
@@ -125,6 +131,19 @@ def main(args):
         const=True,
         default=False,
     )
+    parser_loc.add_argument(
+        "-k",
+        "--concurrency",
+        help="Number of PoIs fetched at once, over as many kept-alive connections, when fetching them one at a time.",
+        type=positive_int,
+        default=1,
+    )
+    parser_loc.add_argument(
+        "--no-batch",
+        help="Fetch the PoIs one request at a time instead of with /pois.",
+        dest="batch",
+        action="store_false",
+    )
     parser_loc.add_argument("lat", help="Latitude.", type=float)
     parser_loc.add_argument("lon", help="Longitude.", type=float)
     parser_loc.set_defaults(callback=client_loc)
@@ -155,6 +174,19 @@ def main(args):
         const=True,
         default=False,
     )
+    parser_grid.add_argument(
+        "-k",
+        "--concurrency",
+        help="Number of PoIs fetched at once, over as many kept-alive connections, when fetching them one at a time.",
+        type=positive_int,
+        default=1,
+    )
+    parser_grid.add_argument(
+        "--no-batch",
+        help="Fetch the PoIs one request at a time instead of with /pois.",
+        dest="batch",
+        action="store_false",
+    )
     parser_grid.add_argument("cell_id", help="Cell identifier.", type=int)
     parser_grid.set_defaults(callback=client_grid)
 
@@ -182,23 +214,111 @@ def get_conn_params(use_tor):
         host = read_hostname(TOR_HOSTNAME_FILENAME)
         proxy = TOR_PROXY
     else:
-        host = "{}:8080".format(SERVER_HOSTNAME)
+        host = "{}:{}".format(SERVER_HOSTNAME, SERVER_PORT)
         proxy = None
 
     return host, proxy
 
 
-def create_session(proxy):
-    """Create a Requests session."""
+def positive_int(value):
+    """Parse a command-line integer that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not {}".format(number))
+    return number
+
+
+def create_session(proxy, pool_size=1):
+    """Create a Requests session.
+
+    The session keeps at most `pool_size` connections alive to the server,
+    and threads sharing it wait for a free connection.
+    """
+
+    if pool_size < 1:
+        raise ValueError("the pool size must be at least 1")
 
     session = requests.session()
 
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
     if proxy:
         session.proxies = {"http": proxy, "https": proxy}
 
     return session
 
 
+def fetch_pois(session, host, poi_ids, batch=True, concurrency=1):
+    """Retrieve the information about PoIs, in the order of `poi_ids`.
+
+    All the PoIs are fetched with /pois requests of at most MAX_POI_BATCH
+    PoIs when `batch` is set. Servers without that endpoint answer 404, and
+    the PoIs are then fetched one /poi request per PoI, `concurrency`
+    requests at a time.
+    """
+
+    if batch and poi_ids:
+        url = "http://{}/pois".format(host)
+        pois = []
+        for start in range(0, len(poi_ids), MAX_POI_BATCH):
+            chunk = poi_ids[start:start + MAX_POI_BATCH]
+            params = {"poi_ids": ",".join(str(poi_id) for poi_id in chunk)}
+            res = session.get(url=url, params=params)
+            if res.status_code == 404:
+                break
+            if res.status_code != 200:
+                raise SimpleHTTPError("Invalid return code {}!".format(res.status_code))
+
+            for poi_id, poi in zip(chunk, res.json()["pois"]):
+                if poi is None:
+                    raise SimpleHTTPError("Unknown PoI {}!".format(poi_id))
+                pois.append(poi)
+        else:
+            return pois
+
+    def fetch_poi(poi_id):
+        url = "http://{}/poi".format(host)
+        params = {"poi_id": poi_id}
+        res = session.get(url=url, params=params)
+        if res.status_code != 200:
+            raise SimpleHTTPError("Invalid return code {}!".format(res.status_code))
+
+        return res.json()
+
+    if concurrency <= 1:
+        return [fetch_poi(poi_id) for poi_id in poi_ids]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(fetch_poi, poi_ids))
+
+
+def query_pois(session, url, params, host, batch=True, concurrency=1):
+    """Send a signed /poi-loc or /poi-grid query, and retrieve the PoIs of the answer."""
+
+    res = session.get(url=url, params=params)
+
+    if res.status_code != 200:
+        raise SimpleHTTPError("Invalid return code {}!".format(res.status_code))
+
+    res_json = res.json()
+
+    poi_ids = res_json["poi_list"]
+
+    # No signature, etc... for retrieving the info about the PoIs themselves.
+    return fetch_pois(session, host, poi_ids, batch, concurrency)
+
+
+def describe_pois(pois):
+    """Return the lines printed for the PoIs of a query."""
+
+    if not pois:
+        return ["Sigh... nothing interesting nearby."]
+
+    return ['You are near "{}".'.format(poi["poi_name"]) for poi in pois]
+
+
 def client_get_pk(args):
     """Handle `get-pk` subcommand."""
 
@@ -306,29 +426,11 @@ def client_loc(args):
     }
 
     # Done in a proper way, we would use HTTPS instead of HTTP.
-    session = create_session(proxy)
-    res = session.get(url=url, params=params)
-
-    if res.status_code != 200:
-        raise SimpleHTTPError("Invalid return code {}!".format(res.status_code))
-
-    res_json = res.json()
-
-    poi_ids = res_json["poi_list"]
-
-    if not poi_ids:
-        print("Sigh... nothing interesting nearby.")
-
-    # No signature, etc... for retrieving the info about the PoIs themselves.
-    for poi_id in poi_ids:
-        url = "http://{}/poi".format(host)
-        params = {"poi_id": poi_id}
-        res = session.get(url=url, params=params)
-        if res.status_code != 200:
-            raise SimpleHTTPError("Invalid return code {}!".format(res.status_code))
+    session = create_session(proxy, args.concurrency)
+    pois = query_pois(session, url, params, host, args.batch, args.concurrency)
 
-        poi = res.json()
-        print('You are near "{}".'.format(poi["poi_name"]))
+    for line in describe_pois(pois):
+        print(line)
 
 
 def client_grid(args):
@@ -358,29 +460,11 @@ def client_grid(args):
     }
 
     # Done in a proper way, we would use HTTPS instead of HTTP.
-    session = create_session(proxy)
-    res = session.get(url=url, params=params)
-
-    if res.status_code != 200:
-        raise SimpleHTTPError("Invalid return code {}!".format(res.status_code))
-
-    res_json = res.json()
-
-    poi_ids = res_json["poi_list"]
-
-    if not poi_ids:
-        print("Sigh... nothing interesting nearby.")
-
-    # No signature, etc... for retrieving the info about the PoIs themselves.
-    for poi_id in poi_ids:
-        url = "http://{}/poi".format(host)
-        params = {"poi_id": poi_id}
-        res = session.get(url=url, params=params)
-        if res.status_code != 200:
-            raise SimpleHTTPError("Invalid return code {}!".format(res.status_code))
+    session = create_session(proxy, args.concurrency)
+    pois = query_pois(session, url, params, host, args.batch, args.concurrency)
 
-        poi = res.json()
-        print('You are near "{}".'.format(poi["poi_name"]))
+    for line in describe_pois(pois):
+        print(line)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,297 @@
+"""
+Persistent client agent.
+
+`client_agent.py start` runs a long-lived process that keeps the decoded
+public key and credential, a pool of presignatures and kept-alive HTTP (or
+Tor) connections, and answers `loc` and `grid` queries on a local UNIX
+socket. The other subcommands are a thin client for that socket: they only
+use the standard library, so they start without importing petrelic.
+
+Requests and responses are single lines of JSON.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+
+DEFAULT_SOCKET = "/tmp/cs523-client-agent.sock"
+
+
+def positive_int(value):
+    """Parse a command-line integer that must be at least 1."""
+    # As client.positive_int, which this module does not import to start fast.
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not {}".format(number))
+    return number
+
+
+class ClientAgent:
+    """State kept by the agent between queries."""
+
+    def __init__(self, public_key, anon_cred, tor=False, batch=True, concurrency=1, presignatures=8,
+                 table_window=None):
+        """Decode the keys and open the session.
+
+        Args:
+            public_key (byte[]): the server's public key (serialized)
+            anon_cred (byte[]): the client's credential (serialized)
+            tor (bool): connect to the server through Tor
+            batch (bool): fetch the PoIs with /pois when possible
+            concurrency (int): the number of PoIs fetched at once otherwise
+            presignatures (int): the number of presignatures kept ready
+            table_window (int): if given, precompute fixed-base tables of
+                this window size for the public key
+        """
+        # pylint: disable=import-outside-toplevel
+        import client as client_cli
+        from your_code import Client
+
+        self.cli = client_cli
+        self.public_key = public_key
+        self.anon_cred = anon_cred
+        self.batch = batch
+        self.concurrency = concurrency
+
+        self.client = Client()
+        self.client.enable_presignatures(public_key, anon_cred, presignatures, background=True,
+                                         table_window=table_window)
+
+        self.host, proxy = client_cli.get_conn_params(tor)
+        self.session = client_cli.create_session(proxy, concurrency)
+
+    def query(self, endpoint, message, params, attrs_revealed):
+        """Sign a query, send it and describe the PoIs of the answer.
+
+        Return:
+            string[]: the lines the `client.py` command would print
+        """
+        params["attrs_revealed"] = attrs_revealed
+        params["signature"] = self.client.sign_request(self.public_key, self.anon_cred, message, attrs_revealed)
+
+        url = "http://{}/{}".format(self.host, endpoint)
+        pois = self.cli.query_pois(self.session, url, params, self.host, self.batch, self.concurrency)
+        return self.cli.describe_pois(pois)
+
+    def loc(self, lat, lon, attrs_revealed):
+        """Handle a `loc` query."""
+        message = ("{},{}".format(lat, lon)).encode("utf-8")
+        return self.query("poi-loc", message, {"lat": lat, "lon": lon}, attrs_revealed)
+
+    def grid(self, cell_id, attrs_revealed):
+        """Handle a `grid` query."""
+        message = ("{}".format(cell_id)).encode("utf-8")
+        return self.query("poi-grid", message, {"cell_id": cell_id}, attrs_revealed)
+
+    def handle(self, request):
+        """Answer a decoded request.
+
+        Return:
+            dict: the response, with the printed lines or an error message
+        """
+        try:
+            if request["command"] == "loc":
+                lines = self.loc(float(request["lat"]), float(request["lon"]), request["reveal"])
+            elif request["command"] == "grid":
+                lines = self.grid(int(request["cell_id"]), request["reveal"])
+            else:
+                return {"error": "unknown command {}".format(request["command"])}
+        except Exception as exc:  # pylint: disable=broad-except
+            return {"error": "{}: {}".format(type(exc).__name__, exc)}
+
+        return {"lines": lines}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line)
+            if request.get("command") == "stop":
+                self.wfile.write(b'{"lines": []}\n')
+                self.wfile.flush()
+                # Handlers run in their own thread, so this does not wait on itself.
+                self.server.shutdown()
+                return
+
+            response = self.server.agent.handle(request)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, agent):
+        super().__init__(socket_path, _Handler)
+        self.agent = agent
+
+
+def send(socket_path, request):
+    """Send a request to a running agent and return its response."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as response:
+            return json.loads(response.readline())
+
+
+def main(args):
+    """Parse the arguments given to the agent, and call the appropriate method."""
+
+    parser = argparse.ArgumentParser(description="Persistent client for CS-523 project.")
+    parser.add_argument(
+        "-s",
+        "--socket",
+        help="Path of the agent's UNIX socket.",
+        type=str,
+        default=DEFAULT_SOCKET,
+    )
+    subparsers = parser.add_subparsers(help="Command")
+
+    parser_start = subparsers.add_parser("start", help="Run the agent in the foreground.")
+    parser_start.add_argument(
+        "-p",
+        "--pub",
+        help="Name of the file from which to read the public key.",
+        type=argparse.FileType("rb"),
+        required=True,
+    )
+    parser_start.add_argument(
+        "-c",
+        "--cred",
+        help="Name of the file from which to read the attribute-based credential.",
+        type=argparse.FileType("rb"),
+        required=True,
+    )
+    parser_start.add_argument(
+        "-t",
+        "--tor",
+        help="Use Tor to connect to the server.",
+        action="store_const",
+        const=True,
+        default=False,
+    )
+    parser_start.add_argument(
+        "-k",
+        "--concurrency",
+        help="Number of PoIs fetched at once when fetching them one at a time.",
+        type=positive_int,
+        default=1,
+    )
+    parser_start.add_argument(
+        "--no-batch",
+        help="Fetch the PoIs one request at a time instead of with /pois.",
+        dest="batch",
+        action="store_false",
+    )
+    parser_start.add_argument(
+        "--presignatures",
+        help="Number of presignatures kept ready.",
+        type=int,
+        default=8,
+    )
+    parser_start.add_argument(
+        "-w",
+        "--table-window",
+        help="Precompute fixed-base tables of this window size for the public key.",
+        type=int,
+        default=None,
+    )
+    parser_start.set_defaults(callback=agent_start)
+
+    parser_loc = subparsers.add_parser("loc", help="Send a `loc` query to the agent.")
+    parser_loc.add_argument(
+        "-r",
+        "--reveal",
+        help="Attributes to reveal. (format: attr1,attr2,attr3).",
+        type=str,
+        required=True,
+    )
+    parser_loc.add_argument("lat", help="Latitude.", type=float)
+    parser_loc.add_argument("lon", help="Longitude.", type=float)
+    parser_loc.set_defaults(callback=agent_loc)
+
+    parser_grid = subparsers.add_parser("grid", help="Send a `grid` query to the agent.")
+    parser_grid.add_argument(
+        "-r", "--reveal", help="Attributes to reveal.", type=str, required=True
+    )
+    parser_grid.add_argument("cell_id", help="Cell identifier.", type=int)
+    parser_grid.set_defaults(callback=agent_grid)
+
+    parser_stop = subparsers.add_parser("stop", help="Stop the agent.")
+    parser_stop.set_defaults(callback=agent_stop)
+
+    namespace = parser.parse_args(args)
+
+    if "callback" in namespace:
+        return namespace.callback(namespace)
+
+    parser.print_help()
+    return 0
+
+
+def agent_start(args):
+    """Handle `start` subcommand."""
+
+    try:
+        public_key = args.pub.read()
+        anon_cred = args.cred.read()
+
+    finally:
+        args.pub.close()
+        args.cred.close()
+
+    agent = ClientAgent(
+        public_key,
+        anon_cred,
+        tor=args.tor,
+        batch=args.batch,
+        concurrency=args.concurrency,
+        presignatures=args.presignatures,
+        table_window=args.table_window,
+    )
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    with _Server(args.socket, agent) as server:
+        try:
+            server.serve_forever(poll_interval=0.1)
+        finally:
+            os.unlink(args.socket)
+
+    return 0
+
+
+def _forward(args, request):
+    response = send(args.socket, request)
+    if "error" in response:
+        print(response["error"], file=sys.stderr)
+        return 1
+
+    for line in response["lines"]:
+        print(line)
+    return 0
+
+
+def agent_loc(args):
+    """Handle `loc` subcommand."""
+    return _forward(args, {"command": "loc", "lat": args.lat, "lon": args.lon, "reveal": args.reveal})
+
+
+def agent_grid(args):
+    """Handle `grid` subcommand."""
+    return _forward(args, {"command": "grid", "cell_id": args.cell_id, "reveal": args.reveal})
+
+
+def agent_stop(args):
+    """Handle `stop` subcommand."""
+    return _forward(args, {"command": "stop"})
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
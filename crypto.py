@@ -4,10 +4,39 @@ import hashlib
 from petrelic.bn import Bn
 from petrelic.multiplicative.pairing import G1, G2
 
+from multiexp import FixedBaseTable, multiexp
+
+_GENERATOR_TABLES = {}
+
+
+def generator_table(group, window=4):
+    """Return the fixed-base table of the generator of a group.
+
+    Tables are built once per group and window size, and shared by all keys.
+
+    Args:
+        group (petrelic.multiplicative.G1/G2): the group
+        window (int): the window size, in bits
+
+    Return:
+        FixedBaseTable: the table of group.generator()
+    """
+    key = (group.generator().to_binary(), window)
+    table = _GENERATOR_TABLES.get(key)
+    if table is None:
+        table = FixedBaseTable(group, group.generator(), window)
+        _GENERATOR_TABLES[key] = table
+    return table
+
 
 class PublicKey:
     """Public Key in PS cryptosystem."""
 
+    # Fixed-base tables, see precompute, and attribute schema, see
+    # attribute_schema. They are never serialized.
+    tables = None
+    schema = None
+
     def __init__(self, X2, Y1, Y2, valid_attributes):
         """Initialize a public key.
 
@@ -25,22 +54,172 @@ class PublicKey:
         self.Y2 = Y2.copy()
         self.valid_attributes = valid_attributes
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("tables", None)
+        state.pop("schema", None)
+        return state
+
     @staticmethod
-    def from_secret_key(sk):
+    def from_secret_key(sk, window=None):
         """Initialize a public using a secret key.
 
         Args:
             sk (SecretKey): the secret key
+            window (int): if given, exponentiate the generators with
+                fixed-base tables of this window size
 
         Return:
             PublicKey: a new instance of the class
         """
-        X2 = G2.generator() ** sk.x
-        Y1 = list(map(lambda y: G1.generator() ** y, sk.y))
-        Y2 = list(map(lambda y: G2.generator() ** y, sk.y))
+        if window is None:
+            X2 = G2.generator() ** sk.x
+            Y1 = list(map(lambda y: G1.generator() ** y, sk.y))
+            Y2 = list(map(lambda y: G2.generator() ** y, sk.y))
+        else:
+            g1_table = generator_table(G1, window)
+            g2_table = generator_table(G2, window)
+            X2 = g2_table.pow(sk.x)
+            Y1 = list(map(g1_table.pow, sk.y))
+            Y2 = list(map(g2_table.pow, sk.y))
 
         return PublicKey(X2, Y1, Y2, sk.valid_attributes)
 
+    def precompute(self, window=4):
+        """Attach fixed-base tables to the key.
+
+        This is opt-in: the tables of a key with n attributes hold about
+        2 * (n + 2) * (254 / window) * (2^window - 1) group elements, see
+        KeyTables.footprint.
+
+        Args:
+            window (int): the window size of the tables, in bits
+
+        Return:
+            KeyTables: the tables now attached to the key
+        """
+        self.tables = KeyTables(self, window)
+        return self.tables
+
+
+    def attribute_schema(self):
+        """Return the attribute schema of the key, built on first use.
+
+        Return:
+            AttributeSchema: the schema of the valid attributes
+        """
+        if self.schema is None:
+            self.schema = AttributeSchema(self.valid_attributes)
+        return self.schema
+
+
+class AttributeSchema:
+    """Index of the attributes of a key.
+
+    The attribute at position i of the valid attributes corresponds to Y1[i]
+    and Y2[i]. Position 0 is the user secret key, hence sets of attributes
+    are represented as integer bitmasks where bit i stands for the attribute
+    at position i >= 1.
+    """
+
+    def __init__(self, valid_attributes):
+        """Build the index of a list of attributes.
+
+        Args:
+            valid_attributes (string[]): list of valid attributes, starting
+                with the secret key
+
+        Returns:
+            AttributeSchema: a new instance of the class
+        """
+        self.names = list(valid_attributes)
+        self.positions = {name: i for i, name in enumerate(self.names[1:], 1)}
+
+    def mask(self, attributes, strict=True):
+        """Compute the bitmask of a set of attributes.
+
+        Args:
+            attributes (string[] or string): attribute names, or a comma
+                separated list of attribute names
+            strict (bool): whether unknown attributes are an error, or are
+                ignored
+
+        Return:
+            int: the bitmask
+        """
+        if isinstance(attributes, str):
+            attributes = [attr for attr in attributes.split(",") if attr != ""]
+
+        mask = 0
+        for attr in attributes:
+            position = self.positions.get(attr)
+            if position is not None:
+                mask |= 1 << position
+            elif strict:
+                raise ValueError("unknown attribute {}".format(attr))
+        return mask
+
+    def names_of(self, mask):
+        """Return the names of the attributes of a bitmask."""
+        return [self.names[i] for i in positions(mask)]
+
+
+def positions(mask):
+    """Iterate over the positions of the set bits of a bitmask, in order.
+
+    Args:
+        mask (int): the bitmask
+
+    Yields:
+        int: the positions
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class KeyTables:
+    """Fixed-base tables for the generators and the elements of a public key."""
+
+    def __init__(self, pk, window=4):
+        """Build the tables of a public key.
+
+        Args:
+            pk (PublicKey): the public key
+            window (int): the window size of the tables, in bits
+
+        Returns:
+            KeyTables: a new instance of the class
+        """
+        self.window = window
+        self.g1 = generator_table(G1, window)
+        self.g2 = generator_table(G2, window)
+        self.X2 = FixedBaseTable(G2, pk.X2, window)
+        self.Y1 = [FixedBaseTable(G1, y, window) for y in pk.Y1]
+        self.Y2 = [FixedBaseTable(G2, y, window) for y in pk.Y2]
+
+    def footprint(self):
+        """Report the memory used by the tables.
+
+        Return:
+            dict: the number of stored group elements and their serialized
+            size in bytes, for G1 and G2 tables
+        """
+        g1_tables = [self.g1] + self.Y1
+        g2_tables = [self.g2, self.X2] + self.Y2
+        return {
+            "window": self.window,
+            "G1": {
+                "elements": sum(t.nb_elements() for t in g1_tables),
+                "bytes": sum(t.nbytes() for t in g1_tables),
+            },
+            "G2": {
+                "elements": sum(t.nb_elements() for t in g2_tables),
+                "bytes": sum(t.nbytes() for t in g2_tables),
+            },
+        }
+
 
 class SecretKey:
     """Secret Key in PS cryptosystem."""
@@ -113,10 +292,13 @@ class Signature:
         if len(messages) != len(pk.Y2):
             return False
 
-        acc = pk.X2
-        for i in range(len(messages)):
-            acc = acc * (pk.Y2[i] ** messages[i])
+        # multiexp skips the null messages and multiplies the Y2[i] of the
+        # unit messages, which covers every attribute of a credential.
+        tables = None if pk.tables is None else pk.tables.Y2
+        acc = pk.X2 * multiexp(G2, pk.Y2, messages, tables)
 
+        # petrelic has no multi-pairing (shared Miller loop and final
+        # exponentiation), so the two pairings are computed and compared.
         return self.sigma1.pair(acc) == self.sigma2.pair(G2.generator())
 
 
@@ -139,10 +321,103 @@ class Credential:
         self.signature = signature
 
 
+class Transcript:
+    """Fiat-Shamir transcript.
+
+    Data is absorbed incrementally in a SHA-256 state, so that a constant
+    prefix (e.g. the bases of a proof) can be absorbed once and copied for
+    every proof.
+
+    Without domain, the transcript is in compatibility mode: data is hashed as
+    is, which gives the same challenges as the original implementation, and
+    labels are ignored. With a domain, the domain and the group tag are
+    absorbed first, and every item is hashed with its label and their
+    lengths.
+    """
+
+    def __init__(self, domain=None, group_tag=None):
+        """Create an empty transcript.
+
+        Args:
+            domain (byte[]): the domain separation tag, None for the
+                compatibility mode
+            group_tag (byte[]): the name of the group of the proof, only
+                absorbed in domain separation mode
+
+        Returns:
+            Transcript: a new instance of the class
+        """
+        self.compat = domain is None
+        self.hash = hashlib.sha256()
+
+        if not self.compat:
+            self.absorb(domain, b"domain")
+            self.absorb(group_tag or b"", b"group")
+
+    @staticmethod
+    def for_bases(bases, domain=None, group_tag=None):
+        """Create a transcript which absorbed the bases of a proof.
+
+        Args:
+            bases (petrelic.multiplicative.groupElement[]): the bases
+            domain (byte[]): the domain separation tag, None for the
+                compatibility mode
+            group_tag (byte[]): the name of the group of the proof
+
+        Return:
+            Transcript: the transcript
+        """
+        transcript = Transcript(domain, group_tag)
+        for base in bases:
+            transcript.absorb_element(base, b"base")
+        return transcript
+
+    def copy(self):
+        """Return an independent copy of the transcript."""
+        other = Transcript.__new__(Transcript)
+        other.compat = self.compat
+        other.hash = self.hash.copy()
+        return other
+
+    def absorb(self, data, label=b""):
+        """Absorb some bytes.
+
+        Args:
+            data (byte[]): the bytes
+            label (byte[]): what the bytes stand for
+        """
+        if not self.compat:
+            self.hash.update(len(label).to_bytes(4, "big"))
+            self.hash.update(label)
+            self.hash.update(len(data).to_bytes(8, "big"))
+        self.hash.update(data)
+
+    def absorb_element(self, elem, label=b"", encoding=None):
+        """Absorb the binary encoding of a group element.
+
+        Args:
+            elem (petrelic.multiplicative.groupElement): the element
+            label (byte[]): what the element stands for
+            encoding (byte[]): elem.to_binary(), if already computed
+        """
+        self.absorb(elem.to_binary() if encoding is None else encoding, label)
+
+    def challenge(self, order):
+        """Derive the challenge.
+
+        Args:
+            order (petrelic.bn.Bn): the order of the group of the proof
+
+        Return:
+            petrelic.bn.Bn: the challenge
+        """
+        return Bn.from_hex(self.hash.hexdigest()).mod(order)
+
+
 class GeneralizedSchnorrProof:
     """Represent a PoK for the generalized Schnoor proof."""
 
-    def __init__(self, group, bases, statement=None, secrets=None, responses=None, commitment=None):
+    def __init__(self, group, bases, statement=None, secrets=None, responses=None, commitment=None, tables=None):
         """Create a new instance of a proof.
 
         This allows to prove knowledge of some secrets x_1, ..., x_k in the
@@ -167,6 +442,8 @@ class GeneralizedSchnorrProof:
             secrets (petrelic.bn.Bn[]): the exponent of the representation
             commitment (petrelic.mutliplicative.groupElement): commitment to
                 the random values
+            tables (multiexp.FixedBaseTable[]): optional fixed-base tables
+                aligned with the bases
 
         Return:
             GeneralizedSchnorrProof: a new instance of the class.
@@ -177,10 +454,11 @@ class GeneralizedSchnorrProof:
         self.commitment = commitment
         self.random_exp = None
         self.group = group
+        self.tables = tables
+        self.prefix = None
+        self.encodings = {}
         if statement is None and secrets is not None:
-            self.statement = group.neutral_element()
-            for i in range(len(bases)):
-                self.statement = self.statement * bases[i] ** secrets[i]
+            self.statement = multiexp(group, bases, secrets, tables)
         else:
             self.statement = statement
 
@@ -196,37 +474,68 @@ class GeneralizedSchnorrProof:
         if self.random_exp is None:
             self.random_exp = [self.group.order().random() for _ in range(len(self.bases))]
 
-        com = self.group.neutral_element()
-        for i in range(len(self.bases)):
-            com = com * self.bases[i] ** self.random_exp[i]
+        com = multiexp(self.group, self.bases, self.random_exp, self.tables)
 
         self.commitment = com
 
         return com
 
-    def get_shamir_challenge(self, message=None):
+    def get_shamir_challenge(self, message=None, prefix=None):
         """Generate the challenge for a Prover.
 
         This is used when applying the Fiat-Shamir heuristic.
 
         Args:
             message (byte[]): an optionnal message to sign
+            prefix (Transcript): a transcript which already absorbed the
+                bases, see Transcript.for_bases. It is left untouched.
 
         Return:
             petrelic.bn.Bn: the challenge
         """
-        m = hashlib.sha256()
-        for base in self.bases:
-            m.update(base.to_binary())
-        m.update(self.get_commitment().to_binary())
-        m.update(self.statement.to_binary())
+        if prefix is None:
+            prefix = self.get_transcript_prefix()
+        transcript = prefix.copy()
+
+        commitment = self.get_commitment()
+        transcript.absorb_element(commitment, b"commitment", self.get_encoding(commitment))
+        transcript.absorb_element(self.statement, b"statement", self.get_encoding(self.statement))
 
         if message is not None:
-            m.update(message)
+            transcript.absorb(message, b"message")
+
+        return transcript.challenge(self.group.order())
 
-        c = Bn.from_hex(m.hexdigest()).mod(self.group.order())
+    def get_encoding(self, elem):
+        """Return the binary encoding of an element of the proof.
 
-        return c
+        Encodings are cached by element for the lifetime of the proof, so
+        that an element can be encoded ahead of time (e.g. the commitment of
+        a presignature) or absorbed in several challenges.
+
+        Args:
+            elem (petrelic.multiplicative.groupElement): the element
+
+        Return:
+            byte[]: elem.to_binary()
+        """
+        encoding = self.encodings.get(id(elem))
+        if encoding is None or encoding[0] is not elem:
+            encoding = (elem, elem.to_binary())
+            self.encodings[id(elem)] = encoding
+        return encoding[1]
+
+    def get_transcript_prefix(self):
+        """Return the transcript of the bases of the proof.
+
+        It is computed once per proof, so the bases are only encoded once.
+
+        Return:
+            Transcript: a transcript which absorbed the bases
+        """
+        if self.prefix is None:
+            self.prefix = Transcript.for_bases(self.bases)
+        return self.prefix
 
     def get_responses(self, challenge):
         """Generate the challenge responses.
@@ -259,11 +568,13 @@ class GeneralizedSchnorrProof:
         if self.responses is None:
             raise ValueError("Challenge responses must be given.")
 
-        left = self.commitment * self.statement ** challenge
-        right = self.group.neutral_element()
+        if len(self.responses) > len(self.bases):
+            return False
 
-        for i in range(len(self.responses)):
-            right = right * self.bases[i] ** self.responses[i]
+        left = self.commitment * self.statement ** challenge
+        nb_responses = len(self.responses)
+        tables = None if self.tables is None else self.tables[:nb_responses]
+        right = multiexp(self.group, self.bases[:nb_responses], self.responses, tables)
 
         return left == right
 
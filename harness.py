@@ -0,0 +1,360 @@
+"""
+Benchmark harness.
+
+`measure` times a function with `time.perf_counter_ns`, after a warmup, over
+an iteration count calibrated to a minimal total duration unless it is
+given, and reports percentiles and a 95% confidence interval of the mean.
+
+`run_suite` measures every method of `Server` and `Client` over a sweep of
+attribute counts and revealed-attribute counts, sharing one CA and one set
+of inputs per attribute count, and returns results in the RESULTS_SCHEMA
+format together with metadata on the machine and the group operation counts
+of every method (see opcount). `compare_results` flags the regressions
+between two result files.
+
+Usage:
+    python harness.py suite -o results.json -a 1,5,10,25 -r 0,1,5
+    python harness.py compare baseline.json results.json
+"""
+
+import argparse
+import datetime
+import importlib.metadata
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from statistics import mean, median, stdev
+
+SCHEMA_VERSION = 1
+
+# JSON schema of the result files written by `run_suite`.
+RESULTS_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "required": ["schema_version", "metadata", "results"],
+    "properties": {
+        "schema_version": {"const": SCHEMA_VERSION},
+        "metadata": {"type": "object"},
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name", "params", "stats"],
+                "properties": {
+                    "name": {"type": "string"},
+                    "params": {"type": "object"},
+                    "stats": {
+                        "type": "object",
+                        "required": ["it", "mean", "std", "min", "max", "median", "p90", "p99",
+                                     "ci95_low", "ci95_high"],
+                    },
+                    "ops": {"type": "object", "additionalProperties": {"type": "integer"}},
+                },
+            },
+        },
+    },
+}
+
+# Quantile of the normal distribution for a two-sided 95% interval.
+_Z95 = 1.959964
+
+
+def percentile(values, p):
+    """"
+    Nearest-rank percentile of a list of values.
+    :param values: the values
+    :param p: the percentile, between 0 and 100
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _time_ns(func):
+    start = time.perf_counter_ns()
+    func()
+    return time.perf_counter_ns() - start
+
+
+def measure(func, it=None, keep_res=False, warmup=3, min_time=1.0, min_it=5, max_it=10000):
+    """"
+    Benchmark a function. It should be called with a lambda function, e.g., measure(lambda: 4+4).
+    :param func: The (anonymous) function that is benchmarked
+    :param it: The number of iterations. If None, it is calibrated from the warmup so that the measure lasts about
+        `min_time` seconds, within [min_it, max_it]
+    :param keep_res: Indicates if the individual timings should be kept
+    :param warmup: The number of calls made before measuring
+    :param min_time: The target duration of a calibrated measure, in seconds
+    :param min_it: The minimal calibrated number of iterations
+    :param max_it: The maximal calibrated number of iterations
+    :return: A dict with the number of iterations, the mean, standard deviation, min, max, median, 90th and 99th
+        percentiles and the bounds of a 95% confidence interval of the mean (normal approximation), in seconds
+    """
+    warmup_times = [_time_ns(func) for _ in range(warmup)]
+
+    if it is None:
+        estimate = max(mean(warmup_times) if warmup_times else _time_ns(func), 1)
+        it = max(min_it, min(max_it, math.ceil(min_time * 1e9 / estimate)))
+
+    results = [_time_ns(func) / 1e9 for _ in range(it)]
+
+    res = {
+        "it": it,
+        "mean": mean(results),
+        "std": stdev(results) if it > 1 else 0.0,
+        "min": min(results),
+        "max": max(results),
+        "median": median(results),
+        "p90": percentile(results, 90),
+        "p99": percentile(results, 99),
+    }
+    half_width = _Z95 * res["std"] / math.sqrt(it)
+    res["ci95_low"] = res["mean"] - half_width
+    res["ci95_high"] = res["mean"] + half_width
+
+    if keep_res:
+        res["results"] = results
+
+    return res
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def _package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def environment_metadata():
+    """"
+    Describe the machine and the software the benchmarks run on.
+    :return: A dict of metadata
+    """
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "python_implementation": platform.python_implementation(),
+        "petrelic": _package_version("petrelic"),
+        "git_commit": _git_commit(),
+    }
+
+
+def validate_results(data):
+    """"
+    Check that a decoded result file follows RESULTS_SCHEMA.
+    :param data: the decoded result file
+    :raise ValueError: if a required field is missing or has the wrong version
+    """
+    if data.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError("unsupported schema version {}".format(data.get("schema_version")))
+
+    for field in RESULTS_SCHEMA["required"]:
+        if field not in data:
+            raise ValueError("missing field {}".format(field))
+
+    result_fields = RESULTS_SCHEMA["properties"]["results"]["items"]["required"]
+    stats_fields = RESULTS_SCHEMA["properties"]["results"]["items"]["properties"]["stats"]["required"]
+    for result in data["results"]:
+        for field in result_fields:
+            if field not in result:
+                raise ValueError("missing field {} in a result".format(field))
+        for field in stats_fields:
+            if field not in result["stats"]:
+                raise ValueError("missing statistic {} in {}".format(field, result["name"]))
+
+
+def run_suite(nbrs_attr, nbrs_revealed, it=None, min_time=1.0, progress=print, batch_size=16):
+    """"
+    Benchmark every method of Server and Client.
+    The CA and the inputs are generated once per attribute count. The client holds every attribute of the CA, and
+    sign_request and check_request_signature are measured for each revealed count up to the attribute count. The
+    batch methods, register_many and check_request_signatures_batch, are measured on batches of `batch_size` copies
+    of the same input.
+    :param nbrs_attr: list of the numbers of attributes of the CA (at least 1)
+    :param nbrs_revealed: list of the numbers of revealed attributes
+    :param it: the number of iterations, calibrated if None
+    :param min_time: the target duration of a calibrated measure, in seconds
+    :param progress: function called with a line of progress, or None
+    :param batch_size: the number of items of the batch methods
+    :return: The results, in the RESULTS_SCHEMA format
+    """
+    # pylint: disable=import-outside-toplevel,cell-var-from-loop
+    from opcount import operation_counts
+    from your_code import Server, Client
+
+    results = []
+
+    def record(name, params, func):
+        if progress is not None:
+            progress("# {} {}".format(name, params))
+        results.append({"name": name, "params": params, "stats": measure(func, it, min_time=min_time),
+                        "ops": operation_counts(func)})
+
+    username = "bob"
+    message = "46.52345,6.57890".encode("utf-8")
+    for nbr_attr in nbrs_attr:
+        attrs = ["attr{}".format(i) for i in range(nbr_attr)]
+        attributes = ",".join(attrs)
+        params = {"attributes": nbr_attr}
+
+        server_pk, server_sk = Server.generate_ca(attributes)
+        server = Server()
+        client = Client()
+        issuance_request, state = client.prepare_registration(server_pk, username, attributes)
+        issuance_response = server.register(server_sk, issuance_request, username, attributes)
+        anon_cred = client.proceed_registration_response(server_pk, issuance_response, state)
+
+        record("Server.generate_ca", params, lambda: Server.generate_ca(attributes))
+        record("Client.prepare_registration", params,
+               lambda: client.prepare_registration(server_pk, username, attributes))
+        record("Server.register", params, lambda: server.register(server_sk, issuance_request, username, attributes))
+        registrations = [(issuance_request, username, attributes)] * batch_size
+        record("Server.register_many", dict(params, batch=batch_size),
+               lambda: server.register_many(server_sk, registrations))
+        record("Client.proceed_registration_response", params,
+               lambda: client.proceed_registration_response(server_pk, issuance_response, state))
+
+        for nbr_revealed in nbrs_revealed:
+            if nbr_revealed > nbr_attr:
+                continue
+            revealed = ",".join(attrs[:nbr_revealed])
+            params = {"attributes": nbr_attr, "revealed": nbr_revealed}
+            signature = client.sign_request(server_pk, anon_cred, message, revealed)
+
+            record("Client.sign_request", params, lambda: client.sign_request(server_pk, anon_cred, message, revealed))
+            record("Server.check_request_signature", params,
+                   lambda: server.check_request_signature(server_pk, message, revealed, signature))
+            signatures = [(message, revealed, signature)] * batch_size
+            record("Server.check_request_signatures_batch", dict(params, batch=batch_size),
+                   lambda: server.check_request_signatures_batch(server_pk, signatures))
+
+    return {"schema_version": SCHEMA_VERSION, "metadata": environment_metadata(), "results": results}
+
+
+def _key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare_results(baseline, candidate, threshold=0.05):
+    """"
+    Compare two result files.
+    A measure regresses when its mean grew by more than `threshold` and the 95% confidence intervals of the two means
+    do not overlap. Measures present in only one file are ignored.
+    :param baseline: the decoded baseline result file
+    :param candidate: the decoded candidate result file
+    :param threshold: the relative slowdown tolerated
+    :return: A list of dicts with the name, the params, both means, the ratio and whether the measure regressed
+    """
+    validate_results(baseline)
+    validate_results(candidate)
+
+    base = {_key(result): result for result in baseline["results"]}
+    rows = []
+    for result in candidate["results"]:
+        previous = base.get(_key(result))
+        if previous is None:
+            continue
+
+        old, new = previous["stats"], result["stats"]
+        ratio = new["mean"] / old["mean"] if old["mean"] else math.inf
+        rows.append({
+            "name": result["name"],
+            "params": result["params"],
+            "baseline": old["mean"],
+            "candidate": new["mean"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold and new["ci95_low"] > old["ci95_high"],
+        })
+
+    return rows
+
+
+def main(args):
+    """Parse the arguments given to the harness, and call the appropriate method."""
+
+    parser = argparse.ArgumentParser(description="Benchmark harness for CS-523 project.")
+    subparsers = parser.add_subparsers(help="Command")
+
+    parser_suite = subparsers.add_parser("suite", help="Benchmark every Server and Client method.")
+    parser_suite.add_argument("-o", "--out", help="Name of the result file.", type=str, required=True)
+    parser_suite.add_argument("-a", "--attributes", help="Attribute counts (format: 1,5,10).", type=str,
+                              default="1,5,10,25")
+    parser_suite.add_argument("-r", "--revealed", help="Revealed-attribute counts (format: 0,1,5).", type=str,
+                              default="0,1,5")
+    parser_suite.add_argument("-i", "--iterations", help="Fixed number of iterations per measure.", type=int,
+                              default=None)
+    parser_suite.add_argument("--min-time", help="Target duration of a calibrated measure, in seconds.",
+                              type=float, default=1.0)
+    parser_suite.add_argument("-b", "--batch-size", help="Number of items of the batch methods.", type=int,
+                              default=16)
+    parser_suite.set_defaults(callback=harness_suite)
+
+    parser_compare = subparsers.add_parser("compare", help="Flag regressions between two result files.")
+    parser_compare.add_argument("baseline", help="Baseline result file.", type=argparse.FileType("r"))
+    parser_compare.add_argument("candidate", help="Candidate result file.", type=argparse.FileType("r"))
+    parser_compare.add_argument("-t", "--threshold", help="Relative slowdown tolerated.", type=float, default=0.05)
+    parser_compare.set_defaults(callback=harness_compare)
+
+    namespace = parser.parse_args(args)
+
+    if "callback" in namespace:
+        return namespace.callback(namespace)
+
+    parser.print_help()
+    return 0
+
+
+def harness_suite(args):
+    """Handle `suite` subcommand."""
+    nbrs_attr = [int(n) for n in args.attributes.split(",")]
+    nbrs_revealed = [int(n) for n in args.revealed.split(",")]
+    data = run_suite(nbrs_attr, nbrs_revealed, args.iterations, args.min_time, batch_size=args.batch_size)
+
+    with open(args.out, "w") as out:
+        json.dump(data, out, indent=1)
+    return 0
+
+
+def harness_compare(args):
+    """Handle `compare` subcommand. Exits with 1 if a measure regressed."""
+    with args.baseline, args.candidate:
+        rows = compare_results(json.load(args.baseline), json.load(args.candidate), args.threshold)
+
+    for row in rows:
+        print("{:<40} {:<32} {:>10.3f} ms {:>10.3f} ms {:>7.2f}x {}".format(
+            row["name"], json.dumps(row["params"], sort_keys=True), row["baseline"] * 1e3, row["candidate"] * 1e3,
+            row["ratio"], "REGRESSION" if row["regression"] else ""))
+
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,200 @@
+"""Cache decoded keys and derived material across requests."""
+import collections
+import hashlib
+import threading
+
+from petrelic.multiplicative.pairing import G1
+
+import wire
+from crypto import PublicKey, Transcript, positions
+
+
+def key_digest(data):
+    """Return the digest used to index serialized keys.
+
+    Args:
+        data (byte[] or string): a serialized key
+
+    Return:
+        byte[]: the SHA-256 digest of the serialized key
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).digest()
+
+
+class KeyContext:
+    """Decoded server keys, built once and reused by every request.
+
+    Besides the keys, the context holds the Fiat-Shamir transcript prefix of
+    the issuance proof, whose bases only depend on the public key, and the
+    cache of the G2 products of the revealed attribute sets.
+
+    A context is registered under the digest of each serialized key it was
+    built from, so that both the public key bytes and the secret key bytes
+    resolve to the same instance.
+    """
+
+    _contexts = {}
+    _lock = threading.Lock()
+
+    def __init__(self, pk, sk=None):
+        """Initialize a key context.
+
+        Args:
+            pk (PublicKey): the server's public key
+            sk (SecretKey): the server's secret key, if known
+
+        Returns:
+            KeyContext: a new instance of the class
+        """
+        self.pk = pk
+        self.sk = sk
+        self.issuance_prefix = Transcript.for_bases([G1.generator(), pk.Y1[0]])
+        self.revealed_cache = RevealedProductCache(pk)
+
+    @classmethod
+    def _register(cls, ctx, *serialized, replace=False):
+        with cls._lock:
+            for data in serialized:
+                if data is None:
+                    continue
+                if replace:
+                    cls._contexts[key_digest(data)] = ctx
+                else:
+                    ctx = cls._contexts.setdefault(key_digest(data), ctx)
+        return ctx
+
+    @classmethod
+    def load(cls, server_pk, server_sk=None):
+        """Build the context for a pair of serialized keys and register it.
+
+        Args:
+            server_pk (byte[]): the server's public key (serialized)
+            server_sk (byte[]): the server's secret key (serialized)
+
+        Return:
+            KeyContext: the context for these keys
+        """
+        pk = wire.loads(server_pk)
+        sk = wire.loads(server_sk) if server_sk is not None else None
+        return cls._register(KeyContext(pk, sk), server_pk, server_sk, replace=True)
+
+    @classmethod
+    def from_public_key(cls, server_pk):
+        """Return the context of a serialized public key.
+
+        Args:
+            server_pk (byte[]): the server's public key (serialized)
+
+        Return:
+            KeyContext: the cached context, built on first use
+        """
+        ctx = cls._contexts.get(key_digest(server_pk))
+        if ctx is None:
+            ctx = cls._register(KeyContext(wire.loads(server_pk)), server_pk)
+        return ctx
+
+    @classmethod
+    def from_secret_key(cls, server_sk):
+        """Return the context of a serialized secret key.
+
+        The public key is derived from the secret key only when no context
+        was registered for it beforehand.
+
+        Args:
+            server_sk (byte[]): the server's secret key (serialized)
+
+        Return:
+            KeyContext: the cached context, built on first use
+        """
+        ctx = cls._contexts.get(key_digest(server_sk))
+        if ctx is None:
+            sk = wire.loads(server_sk)
+            ctx = cls._register(KeyContext(PublicKey.from_secret_key(sk), sk), server_sk)
+        return ctx
+
+    def enable_tables(self, window=4):
+        """Attach fixed-base tables to the public key of the context.
+
+        Args:
+            window (int): the window size of the tables, in bits
+
+        Return:
+            crypto.KeyTables: the tables of the public key
+        """
+        if self.pk.tables is None or self.pk.tables.window != window:
+            self.pk.precompute(window)
+        return self.pk.tables
+
+    @classmethod
+    def clear(cls):
+        """Forget every registered context."""
+        with cls._lock:
+            cls._contexts.clear()
+
+
+class RevealedProductCache:
+    """Bounded LRU cache of the G2 products of revealed attribute sets.
+
+    For a bitmask of revealed attributes, the cache holds
+    X2 * prod(Y2[i] for i revealed) along with the positions of the revealed
+    attributes.
+    """
+
+    def __init__(self, pk, maxsize=128):
+        """Create an empty cache.
+
+        Args:
+            pk (PublicKey): the public key
+            maxsize (int): the maximal number of cached attribute sets
+        """
+        self.pk = pk
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, revealed):
+        """Return the product and the positions of a revealed attribute set.
+
+        Args:
+            revealed (int): the bitmask of the revealed attributes
+
+        Return:
+            (petrelic.multiplicative.pairing.G2Element, int[]): the product
+            X2 * prod(Y2[revealed]) and the revealed positions
+        """
+        with self.lock:
+            entry = self.entries.get(revealed)
+            if entry is not None:
+                self.entries.move_to_end(revealed)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        plan = list(positions(revealed))
+        product = self.pk.X2
+        for i in plan:
+            product = product * self.pk.Y2[i]
+        entry = (product, plan)
+
+        with self.lock:
+            self.entries[revealed] = entry
+            self.entries.move_to_end(revealed)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def stats(self):
+        """Return the hit, miss and eviction counters and the current size."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+            }
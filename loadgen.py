@@ -0,0 +1,378 @@
+"""
+End-to-end HTTP load generator.
+
+Starts `server.py run` on a local port, with a freshly generated key and a
+synthetic PoI database, pre-generates issuance requests, credentials and
+request signatures with `Client`, and then drives `/register`, `/poi-loc`,
+`/poi-grid` and `/poi` with a configurable mix of requests.
+
+Arrivals are open-loop when a rate is given: requests are scheduled by a
+Poisson process independently of the responses, and latencies are measured
+from the scheduled time, so a saturated server shows up as growing latencies
+instead of a slower load. Without a rate, `concurrency` workers send requests
+back to back (closed loop).
+
+Everything runs on the local machine, without Tor.
+
+Usage:
+    python loadgen.py --rate 200 --duration 30 --mix register=1,poi-loc=4,poi-grid=4,poi=8
+    python loadgen.py --concurrency 32 --server-args="--async -j 4"
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from harness import percentile
+from your_code import Client
+
+ENDPOINTS = ["register", "poi-loc", "poi-grid", "poi"]
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+
+def create_poi_database(db_path, nbr_pois=1000, nbr_cells=100, seed=0):
+    """Write a synthetic PoI database with the schema of `fingerprint.db`.
+
+    Args:
+        db_path (string): path of the database file
+        nbr_pois (int): the number of PoIs, spread over the cells
+        nbr_cells (int): the number of grid cells, numbered from 1
+        seed (int): seed of the names and ratings
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute(
+            "CREATE TABLE po_i (poi_id INTEGER PRIMARY KEY, poi_name VARCHAR, poi_address VARCHAR, "
+            "grid_id INTEGER, poi_ratings VARCHAR)"
+        )
+        connection.executemany(
+            "INSERT INTO po_i VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    poi_id,
+                    "PoI {}".format(poi_id),
+                    "{} Rue Synthetique".format(rng.randint(1, 200)),
+                    poi_id % nbr_cells + 1,
+                    json.dumps([rng.randint(1, 5) for _ in range(rng.randint(0, 20))]),
+                )
+                for poi_id in range(1, nbr_pois + 1)
+            ],
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class LocalServer:
+    """A `server.py run` process with its own key and database."""
+
+    def __init__(self, port, attributes, nbr_pois=1000, server_args=(), startup_timeout=60.0):
+        """Generate the key and the database, and start the server.
+
+        Args:
+            port (int): the port of the server
+            attributes (string): the valid attributes of the key
+            nbr_pois (int): the number of PoIs of the synthetic database
+            server_args (string[]): extra arguments of `server.py run`
+            startup_timeout (float): seconds to wait for the server to answer
+        """
+        self.folder = tempfile.TemporaryDirectory()
+        self.url = "http://localhost:{}".format(port)
+        pub = os.path.join(self.folder.name, "key.pub")
+        sec = os.path.join(self.folder.name, "key.sec")
+        db = os.path.join(self.folder.name, "fingerprint.db")
+
+        subprocess.run([sys.executable, SERVER_SCRIPT, "gen-ca", "-a", attributes, "-p", pub, "-s", sec],
+                       check=True)
+        create_poi_database(db, nbr_pois)
+
+        self.log = open(os.path.join(self.folder.name, "server.log"), "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT, "run", "-p", pub, "-s", sec, "--db", db, "--port", str(port),
+             *server_args],
+            cwd=self.folder.name,
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+            # The server and its worker processes get their own process group,
+            # so that close can stop all of them.
+            start_new_session=True,
+        )
+
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError("server.py exited with code {}".format(self.process.returncode))
+            try:
+                self.public_key = requests.get(self.url + "/public-key", timeout=1).content
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError("server.py did not start in time") from None
+                time.sleep(0.2)
+
+    def close(self):
+        """Stop the server and its worker processes, and delete its files."""
+        self._signal_group(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        # Kill what survived the server, e.g. workers of a killed server.
+        self._signal_group(signal.SIGKILL)
+        self.log.close()
+        self.folder.cleanup()
+
+    def _signal_group(self, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def prepare_workload(url, public_key, attributes, nbr_payloads=100, nbr_users=4, nbr_pois=1000):
+    """Pre-generate the parameters of the requests of every endpoint.
+
+    Credentials are obtained through `/register`, so the server must be
+    running. Signatures reveal no attribute.
+
+    Return:
+        dict: the list of (method, path, params) of each endpoint, which the
+            load cycles through
+    """
+    client = Client()
+    names = attributes.split(",")
+
+    registrations = []
+    for i in range(nbr_payloads):
+        user_attributes = ",".join(random.sample(names, random.randint(1, len(names))))
+        username = "user{}".format(i)
+        issuance_req, state = client.prepare_registration(public_key, username, user_attributes)
+        registrations.append((username, user_attributes, issuance_req, state))
+
+    credentials = []
+    for username, user_attributes, issuance_req, state in registrations[:nbr_users]:
+        params = {"username": username, "attributes": user_attributes, "issuance_req": issuance_req}
+        res = requests.post(url + "/register", params=params)
+        if res.status_code != 200:
+            raise RuntimeError("registration failed with code {}".format(res.status_code))
+        credentials.append(client.proceed_registration_response(public_key, res.content, state))
+
+    workload = {"register": [], "poi-loc": [], "poi-grid": [], "poi": []}
+    for username, user_attributes, issuance_req, _ in registrations:
+        params = {"username": username, "attributes": user_attributes, "issuance_req": issuance_req}
+        workload["register"].append(("POST", "/register", params))
+
+    for i in range(nbr_payloads):
+        anon_cred = credentials[i % len(credentials)]
+
+        lat = round(random.uniform(46.5, 46.57), 5)
+        lon = round(random.uniform(6.55, 6.65), 5)
+        message = ("{},{}".format(lat, lon)).encode("utf-8")
+        signature = client.sign_request(public_key, anon_cred, message, "")
+        workload["poi-loc"].append(
+            ("GET", "/poi-loc", {"lat": lat, "lon": lon, "attrs_revealed": "", "signature": signature}))
+
+        cell_id = random.randint(1, 100)
+        message = ("{}".format(cell_id)).encode("utf-8")
+        signature = client.sign_request(public_key, anon_cred, message, "")
+        workload["poi-grid"].append(
+            ("GET", "/poi-grid", {"cell_id": cell_id, "attrs_revealed": "", "signature": signature}))
+
+        workload["poi"].append(("GET", "/poi", {"poi_id": random.randint(1, nbr_pois)}))
+
+    return workload
+
+
+class LoadGenerator:
+    """Send a mix of requests and record their outcome per endpoint."""
+
+    def __init__(self, url, workload, mix, concurrency=16, timeout=30.0):
+        """Create the generator.
+
+        Args:
+            url (string): the base URL of the server
+            workload (dict): the request parameters of each endpoint
+            mix (dict): the relative weight of each endpoint
+            concurrency (int): the number of requests in flight at most
+            timeout (float): the timeout of a request, in seconds
+        """
+        self.url = url
+        self.workload = workload
+        self.endpoints = [endpoint for endpoint in ENDPOINTS if mix.get(endpoint)]
+        self.weights = [mix[endpoint] for endpoint in self.endpoints]
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.next_payload = {endpoint: 0 for endpoint in self.endpoints}
+        self.samples = {endpoint: [] for endpoint in self.endpoints}
+        self.lock = threading.Lock()
+
+        self.session = requests.session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+
+    def _pick(self, rng):
+        endpoint = rng.choices(self.endpoints, self.weights)[0]
+        payloads = self.workload[endpoint]
+        with self.lock:
+            index = self.next_payload[endpoint]
+            self.next_payload[endpoint] = (index + 1) % len(payloads)
+        return endpoint, payloads[index]
+
+    def _send(self, endpoint, request, scheduled):
+        method, path, params = request
+        try:
+            res = self.session.request(method, self.url + path, params=params, timeout=self.timeout)
+            status = res.status_code
+        except requests.RequestException:
+            status = None
+        done = time.perf_counter()
+
+        with self.lock:
+            self.samples[endpoint].append((scheduled, done, status))
+
+    def run_open_loop(self, rate, duration, seed=0):
+        """Send requests with exponentially distributed inter-arrival times.
+
+        Requests that find all workers busy wait in the executor queue, and
+        that wait is part of their latency.
+        """
+        rng = random.Random(seed)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = time.perf_counter()
+            scheduled = start
+            while scheduled < start + duration:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                endpoint, request = self._pick(rng)
+                executor.submit(self._send, endpoint, request, scheduled)
+                scheduled += rng.expovariate(rate)
+        return time.perf_counter() - start
+
+    def run_closed_loop(self, duration, seed=0):
+        """Send requests back to back from `concurrency` workers."""
+        start = time.perf_counter()
+        end = start + duration
+
+        def worker(worker_seed):
+            rng = random.Random(worker_seed)
+            while time.perf_counter() < end:
+                endpoint, request = self._pick(rng)
+                self._send(endpoint, request, time.perf_counter())
+
+        threads = [threading.Thread(target=worker, args=(seed + i,)) for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        """Summarize the samples.
+
+        Return:
+            dict: for each endpoint, the number of requests, the error rate,
+                the throughput and the latency percentiles (in seconds)
+        """
+        report = {}
+        for endpoint, samples in self.samples.items():
+            latencies = [done - scheduled for scheduled, done, _ in samples]
+            # A 404 is a valid answer of /poi-grid for an empty cell.
+            errors = sum(1 for _, _, status in samples if status not in (200, 404))
+            report[endpoint] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": errors / len(samples) if samples else 0.0,
+                "throughput": len(samples) / elapsed,
+                "p50": percentile(latencies, 50) if samples else None,
+                "p90": percentile(latencies, 90) if samples else None,
+                "p99": percentile(latencies, 99) if samples else None,
+                "max": max(latencies) if samples else None,
+            }
+        return report
+
+
+def parse_mix(mix):
+    """Parse a mix such as "register=1,poi-loc=4" into a dict of weights."""
+    weights = {}
+    for item in mix.split(","):
+        endpoint, _, weight = item.partition("=")
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError("unknown endpoint {}".format(endpoint))
+        weights[endpoint] = float(weight or 1)
+    return weights
+
+
+def main(args):
+    """Parse the arguments given to the load generator, and run it."""
+
+    parser = argparse.ArgumentParser(description="HTTP load generator for CS-523 project.")
+    parser.add_argument("-c", "--concurrency", help="Maximal number of requests in flight.", type=int, default=16)
+    parser.add_argument("-r", "--rate", help="Open-loop arrival rate, in requests per second. "
+                        "Closed loop if not given.", type=float, default=None)
+    parser.add_argument("-d", "--duration", help="Duration of the load, in seconds.", type=float, default=10.0)
+    parser.add_argument("-m", "--mix", help="Weights of the endpoints (format: register=1,poi-loc=4).",
+                        type=parse_mix, default="register=1,poi-loc=4,poi-grid=4,poi=8")
+    parser.add_argument("-a", "--attributes", help="Number of valid attributes of the generated key.", type=int,
+                        default=5)
+    parser.add_argument("--pois", help="Number of PoIs of the synthetic database.", type=int, default=1000)
+    parser.add_argument("--payloads", help="Number of pre-generated requests per endpoint.", type=int, default=100)
+    parser.add_argument("-p", "--port", help="Port of the local server.", type=int, default=8090)
+    parser.add_argument("--server-args", help="Extra arguments of `server.py run`, e.g. \"--async -j 4\".",
+                        type=str, default="")
+    parser.add_argument("-o", "--out", help="Name of a file in which to write the report as JSON.", type=str,
+                        default=None)
+
+    namespace = parser.parse_args(args)
+
+    attributes = ",".join("attr{}".format(i) for i in range(namespace.attributes))
+    print("# starting server.py...")
+    server = LocalServer(namespace.port, attributes, namespace.pois, shlex.split(namespace.server_args))
+    try:
+        print("# preparing requests...")
+        workload = prepare_workload(server.url, server.public_key, attributes, namespace.payloads,
+                                    nbr_pois=namespace.pois)
+
+        print("# sending load...")
+        generator = LoadGenerator(server.url, workload, namespace.mix, namespace.concurrency)
+        if namespace.rate is None:
+            elapsed = generator.run_closed_loop(namespace.duration)
+        else:
+            elapsed = generator.run_open_loop(namespace.rate, namespace.duration)
+        report = generator.report(elapsed)
+    finally:
+        server.close()
+
+    print("{:<10} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+        "endpoint", "requests", "errors", "req/s", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for endpoint, stats in report.items():
+        if not stats["requests"]:
+            continue
+        print("{:<10} {:>8} {:>6.1%} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            endpoint, stats["requests"], stats["error_rate"], stats["throughput"], stats["p50"] * 1e3,
+            stats["p90"] * 1e3, stats["p99"] * 1e3, stats["max"] * 1e3))
+
+    if namespace.out is not None:
+        with open(namespace.out, "w") as out:
+            json.dump({"arguments": " ".join(args), "report": report}, out, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
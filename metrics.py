@@ -0,0 +1,212 @@
+"""Per-request phase timing, exported in the Prometheus text format.
+
+The phases of a request (parsing, statement construction, challenge hashing,
+proof verification, database lookup, ...) are timed with `METRICS.phase` and
+aggregated into one histogram per endpoint, attribute count and phase. The
+endpoint and the attribute count are labels of the request being served:
+`METRICS.instrument` sets the endpoint around a route handler, and the code
+that learns the attribute count sets it with `METRICS.label`.
+
+Instrumentation is disabled by default. While disabled, `phase` returns a
+shared no-op context manager and `instrument` calls the handler directly, so
+the instrumented code only pays for an attribute lookup and a function call.
+
+Values read when the metrics are rendered, such as the depth of a pool, are
+exported as gauges or counters with `METRICS.value`.
+"""
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+_LABELS = contextvars.ContextVar("metrics_labels", default=None)
+
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+class Histogram:
+    """Cumulative histogram of durations."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record a duration, in seconds."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _PhaseTimer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Registry of the phase histograms."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="secretstroll"):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.enabled = False
+        self.histograms = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        """Start recording."""
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording. The recorded histograms are kept."""
+        self.enabled = False
+
+    def reset(self):
+        """Forget the recorded histograms."""
+        with self.lock:
+            self.histograms = {}
+
+    def phase(self, name):
+        """Return a context manager timing a phase of the current request.
+
+        Args:
+            name (string): the name of the phase
+        """
+        if not self.enabled:
+            return _NULL
+        return _PhaseTimer(self, name)
+
+    def label(self, **labels):
+        """Set labels of the current request, e.g. its attribute count."""
+        if not self.enabled:
+            return
+        current = _LABELS.get()
+        if current is not None:
+            current.update(labels)
+
+    def instrument(self, endpoint):
+        """Decorate a route handler to label its phases with the endpoint, and
+        time the whole handler as the "total" phase."""
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return handler(*args, **kwargs)
+
+                token = _LABELS.set({"endpoint": endpoint, "attributes": ""})
+                try:
+                    with _PhaseTimer(self, "total"):
+                        return handler(*args, **kwargs)
+                finally:
+                    _LABELS.reset(token)
+
+            return wrapper
+
+        return decorator
+
+    def request(self, endpoint):
+        """Return a context manager with the effect of `instrument` on a block."""
+        if not self.enabled:
+            return _NULL
+        return _RequestScope(self, endpoint)
+
+    def observe(self, name, seconds):
+        """Record the duration of a phase of the current request."""
+        labels = _LABELS.get() or {}
+        key = (labels.get("endpoint", ""), str(labels.get("attributes", "")), name)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def value(self, name, description, func, kind="gauge"):
+        """Export a value read when the metrics are rendered, e.g. the depth
+        of a queue.
+
+        Args:
+            name (string): the name of the metric, without the prefix
+            description (string): the help text of the metric
+            func (callable): returns the current value
+            kind (string): the Prometheus type, "gauge" or "counter"
+        """
+        with self.lock:
+            self.values[name] = (description, func, kind)
+
+    def render(self):
+        """Return the histograms in the Prometheus text exposition format."""
+        metric = "{}_phase_seconds".format(self.prefix)
+        lines = [
+            "# HELP {} Duration of the phases of the requests.".format(metric),
+            "# TYPE {} histogram".format(metric),
+        ]
+
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for (endpoint, attributes, phase), histogram in items:
+                labels = 'endpoint="{}",attributes="{}",phase="{}"'.format(endpoint, attributes, phase)
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, labels, bound, cumulative))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(metric, labels, histogram.count))
+                lines.append("{}_sum{{{}}} {}".format(metric, labels, repr(histogram.sum)))
+                lines.append("{}_count{{{}}} {}".format(metric, labels, histogram.count))
+
+            for name, (description, func, kind) in sorted(self.values.items()):
+                value_metric = "{}_{}".format(self.prefix, name)
+                lines.append("# HELP {} {}".format(value_metric, description))
+                lines.append("# TYPE {} {}".format(value_metric, kind))
+                lines.append("{} {}".format(value_metric, func()))
+
+        return "\n".join(lines) + "\n"
+
+
+class _RequestScope:
+    def __init__(self, metrics, endpoint):
+        self.timer = _PhaseTimer(metrics, "total")
+        self.endpoint = endpoint
+        self.token = None
+
+    def __enter__(self):
+        self.token = _LABELS.set({"endpoint": self.endpoint, "attributes": ""})
+        self.timer.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.__exit__(*exc)
+        _LABELS.reset(self.token)
+        return False
+
+
+# Registry used by the server.
+METRICS = Metrics()
@@ -0,0 +1,247 @@
+"""Multi-exponentiation in the pairing groups G1, G2 and GT.
+
+The functions of this module compute products of the form
+bases[0]^exps[0] * ... * bases[k-1]^exps[k-1] with fewer group operations than
+one independent exponentiation per base. Only the group multiplication is
+used, so the same code works for the three groups of the multiplicative API of
+petrelic.
+"""
+
+from petrelic.bn import Bn
+
+# Below this number of bases, interleaved windows (Straus) are cheaper than
+# buckets (Pippenger), because the bucket aggregation does not pay off. A
+# single base is always exponentiated natively, see benchmark_multiexp in
+# benchmarks.py to compare the three methods on a machine.
+PIPPENGER_THRESHOLD = 32
+
+STRAUS_WINDOW = 4
+
+
+def multiexp(group, bases, exps, tables=None):
+    """Compute the product of bases[i] ** exps[i].
+
+    Exponents are reduced modulo the group order. Bases with a zero exponent
+    are skipped and bases with an exponent equal to one are multiplied
+    directly. A single remaining base uses the native exponentiation. Bases that come with a fixed-base table are exponentiated with
+    their table.
+
+    Args:
+        group (petrelic.multiplicative.G1/G2/GT): the group of the bases
+        bases (petrelic.multiplicative.groupElement[]): the bases
+        exps (petrelic.bn.Bn[] or int[]): the exponents
+        tables (FixedBaseTable[]): optional tables aligned with the bases,
+            None entries standing for bases without table
+
+    Return:
+        petrelic.multiplicative.groupElement: the product
+    """
+    if len(bases) != len(exps):
+        raise ValueError("The number of bases and exponents must be equal.")
+    if tables is None:
+        tables = [None] * len(bases)
+
+    order = int(group.order())
+    acc = None
+    pending_bases = []
+    pending_scalars = []
+    for base, exp, table in zip(bases, exps, tables):
+        scalar = int(exp) % order
+        if scalar == 0:
+            continue
+        if scalar == 1:
+            acc = _mul(acc, base)
+            continue
+        if table is not None:
+            acc = _mul(acc, table.pow(scalar))
+            continue
+        pending_bases.append(base)
+        pending_scalars.append(scalar)
+
+    if pending_bases:
+        if len(pending_bases) == 1:
+            # Nothing to share between bases: the native exponentiation of
+            # petrelic beats the windows computed in Python.
+            acc = _mul(acc, pending_bases[0] ** Bn.from_num(pending_scalars[0]))
+        elif len(pending_bases) < PIPPENGER_THRESHOLD:
+            acc = _mul(acc, straus(pending_bases, pending_scalars))
+        else:
+            acc = _mul(acc, pippenger(pending_bases, pending_scalars))
+
+    if acc is None:
+        return group.neutral_element()
+    return acc
+
+
+def straus(bases, scalars, window=STRAUS_WINDOW):
+    """Interleaved fixed-window multi-exponentiation.
+
+    Every base gets a table of its 2^window - 1 first powers, and all the
+    exponents share the same chain of squarings.
+
+    Args:
+        bases (petrelic.multiplicative.groupElement[]): the bases
+        scalars (int[]): the exponents, non-negative and not all zero
+        window (int): the window size, in bits
+
+    Return:
+        petrelic.multiplicative.groupElement: the product
+    """
+    tables = []
+    for base in bases:
+        row = [None, base]
+        for _ in range(2, 1 << window):
+            row.append(row[-1] * base)
+        tables.append(row)
+
+    mask = (1 << window) - 1
+    nb_windows = _nb_windows(scalars, window)
+
+    acc = None
+    for j in reversed(range(nb_windows)):
+        acc = _square(acc, window)
+        shift = j * window
+        for row, scalar in zip(tables, scalars):
+            digit = (scalar >> shift) & mask
+            if digit:
+                acc = _mul(acc, row[digit])
+
+    return acc
+
+
+def pippenger(bases, scalars, window=None):
+    """Bucket multi-exponentiation.
+
+    For every window, the bases are sorted in buckets according to their
+    digit, and the buckets are aggregated with running products, which costs
+    about k + 2^(window+1) multiplications per window for k bases.
+
+    Args:
+        bases (petrelic.multiplicative.groupElement[]): the bases
+        scalars (int[]): the exponents, non-negative and not all zero
+        window (int): the window size in bits, derived from the number of
+            bases when not given
+
+    Return:
+        petrelic.multiplicative.groupElement: the product
+    """
+    if window is None:
+        window = max(2, len(bases).bit_length() - 2)
+
+    mask = (1 << window) - 1
+    nb_windows = _nb_windows(scalars, window)
+
+    acc = None
+    for j in reversed(range(nb_windows)):
+        acc = _square(acc, window)
+        shift = j * window
+
+        buckets = [None] * (mask + 1)
+        for base, scalar in zip(bases, scalars):
+            digit = (scalar >> shift) & mask
+            if digit:
+                buckets[digit] = _mul(buckets[digit], base)
+
+        # sum_d buckets[d]^d computed as the product of the running products
+        running = None
+        window_acc = None
+        for digit in range(mask, 0, -1):
+            running = _mul(running, buckets[digit])
+            if running is not None:
+                window_acc = _mul(window_acc, running)
+
+        acc = _mul(acc, window_acc)
+
+    return acc
+
+
+class FixedBaseTable:
+    """Comb table for the exponentiation of a fixed base.
+
+    The table stores base^(d * 2^(window * j)) for every digit d of the
+    window and every window position j, so that an exponentiation only costs
+    one multiplication per window, without any squaring. A larger window
+    means fewer multiplications but a table that grows as 2^window.
+    """
+
+    def __init__(self, group, base, window=4):
+        """Build the table of a base.
+
+        Args:
+            group (petrelic.multiplicative.G1/G2/GT): the group of the base
+            base (petrelic.multiplicative.groupElement): the fixed base
+            window (int): the window size, in bits
+
+        Returns:
+            FixedBaseTable: a new instance of the class
+        """
+        if window < 1:
+            raise ValueError("The window size must be positive.")
+
+        self.group = group
+        self.base = base
+        self.window = window
+        self.order = int(group.order())
+
+        nb_windows = (self.order.bit_length() + window - 1) // window
+        self.rows = []
+        current = base
+        for _ in range(nb_windows):
+            row = [None, current]
+            for _ in range(2, 1 << window):
+                row.append(row[-1] * current)
+            self.rows.append(row)
+            current = row[-1] * current
+
+    def pow(self, exp):
+        """Compute base ** exp.
+
+        Args:
+            exp (petrelic.bn.Bn or int): the exponent
+
+        Return:
+            petrelic.multiplicative.groupElement: the power of the base
+        """
+        scalar = int(exp) % self.order
+        mask = (1 << self.window) - 1
+
+        acc = None
+        for row in self.rows:
+            digit = scalar & mask
+            if digit:
+                acc = _mul(acc, row[digit])
+            scalar >>= self.window
+
+        if acc is None:
+            return self.group.neutral_element()
+        return acc
+
+    def nb_elements(self):
+        """Return the number of group elements stored in the table."""
+        return len(self.rows) * ((1 << self.window) - 1)
+
+    def nbytes(self):
+        """Return the size of the stored elements, in serialized bytes."""
+        return self.nb_elements() * len(self.base.to_binary())
+
+
+def _nb_windows(scalars, window):
+    nb_bits = max(scalar.bit_length() for scalar in scalars)
+    return (nb_bits + window - 1) // window
+
+
+def _mul(acc, elem):
+    """Multiply two elements where None stands for the neutral element."""
+    if acc is None:
+        return elem
+    if elem is None:
+        return acc
+    return acc * elem
+
+
+def _square(acc, times):
+    if acc is None:
+        return None
+    for _ in range(times):
+        acc = acc * acc
+    return acc
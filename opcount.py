@@ -0,0 +1,182 @@
+"""Counters of group operations, for deterministic cost accounting.
+
+Within `count_operations()`, the arithmetic methods of the petrelic G1, G2
+and GT elements, `hashlib.sha256` and the `wire` serialization functions are
+wrapped to count their calls:
+
+    with count_operations() as ops:
+        server.check_request_signature(server_pk, message, revealed, sig)
+    ops["pairings"], ops["G2.exp"], ops["hash"]
+
+Keys are "pairings", "<group>.<op>" for op in exp, mul, div, inv, square,
+to_binary and from_binary, "hash" (SHA-256 objects created), "hash.update",
+"hash.digest", "wire.dumps" and "wire.loads". Only the outermost group
+operation is counted, so an operation that petrelic implements with other
+operations counts once.
+
+The patches are global: calls made by other threads during the block are
+counted as well. Blocks can be nested, and every active counter sees the
+calls.
+"""
+
+import contextlib
+import functools
+import hashlib
+import inspect
+import threading
+from collections import Counter
+
+from petrelic.multiplicative.pairing import G1Element, G2Element, GTElement
+
+import wire
+
+# Element methods and the operation they count as.
+_ELEMENT_METHODS = {
+    "__mul__": "mul",
+    "__imul__": "mul",
+    "__truediv__": "div",
+    "__itruediv__": "div",
+    "__pow__": "exp",
+    "__ipow__": "exp",
+    "inverse": "inv",
+    "square": "square",
+    "pair": "pairings",
+    "to_binary": "to_binary",
+    "from_binary": "from_binary",
+}
+
+_GROUPS = [("G1", G1Element), ("G2", G2Element), ("GT", GTElement)]
+
+_lock = threading.Lock()
+_active = []
+_originals = []
+_depth = threading.local()
+_MISSING = object()
+
+
+def _record(key):
+    for counter in _active:
+        counter[key] += 1
+
+
+def _wrap_element_method(func, key):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_depth, "value", 0)
+        if depth == 0:
+            _record(key)
+        _depth.value = depth + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _depth.value = depth
+
+    return wrapper
+
+
+def _wrap_function(func, key):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _record(key)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+class _CountingHash:
+    """Proxy of a hashlib object counting the updates and digests."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def update(self, data):
+        _record("hash.update")
+        self.inner.update(data)
+
+    def digest(self):
+        _record("hash.digest")
+        return self.inner.digest()
+
+    def hexdigest(self):
+        _record("hash.digest")
+        return self.inner.hexdigest()
+
+    def copy(self):
+        return _CountingHash(self.inner.copy())
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def _patch(owner, name, replacement):
+    _originals.append((owner, name, owner.__dict__.get(name, _MISSING)))
+    setattr(owner, name, replacement)
+
+
+def _install():
+    for group, cls in _GROUPS:
+        for name, op in _ELEMENT_METHODS.items():
+            # The methods may be inherited from a base class shared by the
+            # groups, so they are looked up on the MRO and patched on cls.
+            attr = inspect.getattr_static(cls, name, None)
+            if attr is None or getattr(object, name, None) is attr:
+                continue
+            key = op if op == "pairings" else "{}.{}".format(group, op)
+            if isinstance(attr, classmethod):
+                _patch(cls, name, classmethod(_wrap_element_method(attr.__func__, key)))
+            elif isinstance(attr, staticmethod):
+                _patch(cls, name, staticmethod(_wrap_element_method(attr.__func__, key)))
+            else:
+                _patch(cls, name, _wrap_element_method(attr, key))
+
+    sha256 = hashlib.sha256
+
+    def counting_sha256(*args, **kwargs):
+        _record("hash")
+        return _CountingHash(sha256(*args, **kwargs))
+
+    _patch(hashlib, "sha256", counting_sha256)
+    _patch(wire, "dumps", _wrap_function(wire.dumps, "wire.dumps"))
+    _patch(wire, "loads", _wrap_function(wire.loads, "wire.loads"))
+
+
+def _uninstall():
+    while _originals:
+        owner, name, original = _originals.pop()
+        if original is _MISSING:
+            delattr(owner, name)
+        else:
+            setattr(owner, name, original)
+
+
+@contextlib.contextmanager
+def count_operations():
+    """Count the group operations, hashes and serializations of a block.
+
+    Yields:
+        collections.Counter: the counts, filled while the block runs
+    """
+    counter = Counter()
+    with _lock:
+        if not _active:
+            _install()
+        _active.append(counter)
+
+    try:
+        yield counter
+    finally:
+        with _lock:
+            del _active[next(i for i, active in enumerate(_active) if active is counter)]
+            if not _active:
+                _uninstall()
+
+
+def operation_counts(func):
+    """Call a function once and return the counts of its operations.
+
+    Return:
+        dict: the non-zero counts, sorted by key
+    """
+    with count_operations() as ops:
+        func()
+    return dict(sorted(ops.items()))
@@ -0,0 +1,129 @@
+"""In-memory index of the PoI table.
+
+The PoI database does not change while the server runs, so it is loaded once
+into an array of PoI ids per grid cell and a record store indexed by PoI id,
+with the ratings already parsed. Lookups are then served from memory. The
+file is checked for changes at most once per `check_interval` seconds, and
+reloaded when it changed.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+
+class PoIIndex:
+    """Grid cell and PoI id lookups over a snapshot of the PoI table."""
+
+    def __init__(self, db_path, table="po_i", check_interval=1.0):
+        """Load the PoI table.
+
+        Args:
+            db_path (string): path of the SQLite database
+            table (string): name of the PoI table
+            check_interval (float): minimal number of seconds between two
+                checks of the database file
+        """
+        self.db_path = db_path
+        self.table = table
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.next_check = 0.0
+        self.version = None
+        self.snapshot = ([], {})
+        self.reload()
+
+    def _file_version(self):
+        stat = os.stat(self.db_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        """Load the PoI table from the database file."""
+        version = self._file_version()
+        query = "SELECT poi_id, poi_name, poi_address, grid_id, poi_ratings FROM {}".format(self.table)
+
+        connection = sqlite3.connect(self.db_path)
+        try:
+            rows = connection.execute(query).fetchall()
+        finally:
+            connection.close()
+
+        records = {}
+        cell_ids = {}
+        for poi_id, poi_name, poi_address, grid_id, poi_ratings in sorted(rows):
+            records[poi_id] = {
+                "poi_id": poi_id,
+                "poi_name": poi_name,
+                "poi_address": poi_address,
+                "grid_id": grid_id,
+                "poi_ratings": json.loads(poi_ratings),
+            }
+            if grid_id is not None and grid_id >= 0:
+                cell_ids.setdefault(grid_id, []).append(poi_id)
+
+        cells = [array("q") for _ in range(max(cell_ids, default=-1) + 1)]
+        for grid_id, poi_ids in cell_ids.items():
+            cells[grid_id].extend(poi_ids)
+
+        # Readers take both structures at once, from a single attribute.
+        self.snapshot = (cells, records)
+        self.version = version
+
+    def refresh(self):
+        """Reload the PoI table if the database file changed since it was loaded.
+
+        Return:
+            bool: whether the table was reloaded
+        """
+        now = time.monotonic()
+        if now < self.next_check:
+            return False
+
+        with self.lock:
+            if now < self.next_check:
+                return False
+            self.next_check = now + self.check_interval
+            try:
+                changed = self._file_version() != self.version
+            except OSError:
+                return False
+            if changed:
+                self.reload()
+            return changed
+
+    def poi_ids(self, grid_id):
+        """Return the ids of the PoIs of a grid cell.
+
+        Args:
+            grid_id (int): the grid cell
+
+        Return:
+            int[]: the PoI ids, in increasing order
+        """
+        self.refresh()
+        cells, _ = self.snapshot
+        if 0 <= grid_id < len(cells):
+            return cells[grid_id].tolist()
+        return []
+
+    def poi(self, poi_id):
+        """Return the record of a PoI.
+
+        The ratings are parsed, and the record is a copy that the caller may
+        modify.
+
+        Args:
+            poi_id (int): the PoI id
+
+        Return:
+            dict: the record, or None if there is no such PoI
+        """
+        self.refresh()
+        _, records = self.snapshot
+        record = records.get(poi_id)
+        if record is None:
+            return None
+        return dict(record)
@@ -6,13 +6,23 @@ Server entrypoint.
 """
 
 import argparse
-import json
+import atexit
+import functools
+import queue
 import random
+import signal
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 from flask import Flask, jsonify, make_response, request
 from flask_sqlalchemy import SQLAlchemy
 
+from keys import KeyContext
+from metrics import METRICS
+from poi_index import PoIIndex
+from workers import CryptoWorkerPool, PoolBusyError
 from your_code import Server
 
 
@@ -64,6 +74,78 @@ def main(args):
         type=argparse.FileType("rb"),
         required=True,
     )
+    parser_run.add_argument(
+        "-w",
+        "--table-window",
+        help="Precompute fixed-base tables of this window size for the keys.",
+        type=int,
+        default=None,
+    )
+
+    parser_run.add_argument(
+        "-b",
+        "--batch-window",
+        help="Collect request signatures for this many milliseconds and verify them together. A batch of N "
+        "signatures costs N * (A + 4) pairings to parse and A + 3 to verify, for A attributes, instead of "
+        "N * (A + 5); batches of fewer than A + 3 signatures are verified one by one.",
+        type=float,
+        default=None,
+    )
+
+    parser_run.add_argument(
+        "-j",
+        "--workers",
+        help="Run registrations and signature checks in this many worker processes.",
+        type=int,
+        default=None,
+    )
+    parser_run.add_argument(
+        "--worker-timeout",
+        help="Seconds to wait for a worker before answering 503.",
+        type=float,
+        default=5.0,
+    )
+    parser_run.add_argument(
+        "--issuance-pool",
+        help="Keep this many precomputed issuance exponents ready for registrations.",
+        type=int,
+        default=None,
+    )
+    parser_run.add_argument(
+        "--issuance-low-watermark",
+        help="Refill the issuance pool when fewer exponents are ready, half of the pool by default.",
+        type=int,
+        default=None,
+    )
+    parser_run.add_argument(
+        "--issuance-producer",
+        help="Refill the issuance pool from a thread or a process. The worker processes of -j use a thread.",
+        choices=["thread", "process"],
+        default="thread",
+    )
+    parser_run.add_argument(
+        "--db",
+        help="Name of the PoI database file, instead of the configured fingerprint.db.",
+        type=str,
+        default=None,
+    )
+    parser_run.add_argument(
+        "--port",
+        help="Port to listen on.",
+        type=int,
+        default=8080,
+    )
+    parser_run.add_argument(
+        "--metrics",
+        help="Time the phases of the requests and export them on /metrics.",
+        action="store_true",
+    )
+    parser_run.add_argument(
+        "--async",
+        help="Serve the API with the asyncio (ASGI) application instead of Flask.",
+        dest="use_async",
+        action="store_true",
+    )
 
     parser_run.set_defaults(callback=server_run)
 
@@ -104,6 +186,9 @@ def server_run(args):
     global PUBLIC_KEY
     global SECRET_KEY
     global SERVER
+    global BATCH_VERIFIER
+    global WORKER_POOL
+    global POI_INDEX
 
     try:
         PUBLIC_KEY = args.pub.read()
@@ -113,12 +198,214 @@ def server_run(args):
         args.pub.close()
         args.sec.close()
 
+    if args.metrics:
+        METRICS.enable()
+
+    ctx = KeyContext.load(PUBLIC_KEY, SECRET_KEY)
+    if args.table_window is not None:
+        tables = ctx.enable_tables(args.table_window)
+        print("Fixed-base tables: {}".format(tables.footprint()))
     SERVER = Server()
+    if args.workers is not None:
+        WORKER_POOL = CryptoWorkerPool(
+            PUBLIC_KEY,
+            SECRET_KEY,
+            workers=args.workers,
+            timeout=args.worker_timeout,
+            table_window=args.table_window,
+            issuance_pool=args.issuance_pool,
+            issuance_low_watermark=args.issuance_low_watermark,
+        )
+    elif args.issuance_pool is not None:
+        pool = SERVER.enable_issuance_pool(
+            args.issuance_pool,
+            args.issuance_low_watermark,
+            process=args.issuance_producer == "process",
+            table_window=args.table_window,
+        )
+        METRICS.value("issuance_pool_depth", "Precomputed issuance exponents ready.",
+                      lambda: pool.stats()["depth"])
+        METRICS.value("issuance_pool_taken_total", "Issuance exponents taken from the pool.",
+                      lambda: pool.stats()["taken"], kind="counter")
+        METRICS.value("issuance_pool_starved_total", "Issuance exponents computed because the pool was empty.",
+                      lambda: pool.stats()["starved"], kind="counter")
+
+    if args.batch_window is not None:
+        # Batches must be allowed to grow well past the size from which the
+        # combined check pays off, which grows with the number of attributes.
+        min_batch = Server.min_batch_size(ctx.pk)
+        max_batch = max(64, 4 * min_batch)
+        if WORKER_POOL is not None:
+            # The batches are split across the workers, in chunks that are
+            # still large enough to be combined.
+            submit_batch = functools.partial(WORKER_POOL.submit_check_request_signatures_batch, min_chunk=min_batch)
+            timeout = args.worker_timeout
+        else:
+            executor = ThreadPoolExecutor(thread_name_prefix="batch-verifier")
+            submit_batch = functools.partial(executor.submit, SERVER.check_request_signatures_batch, PUBLIC_KEY)
+            timeout = None
+        BATCH_VERIFIER = BatchVerifier(submit_batch, args.batch_window / 1000, max_batch, timeout)
+
+    db_path = args.db
+    if db_path is None:
+        with APP.app_context():
+            db_path = DB.engine.url.database
+    POI_INDEX = PoIIndex(db_path, PoI.__tablename__)
+
+    # Stop the worker processes and the issuance pool when the server exits,
+    # also on SIGTERM.
+    atexit.register(shutdown)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
 
     host = "0.0.0.0"
-    port = 8080
+    port = args.port
+
+    if args.use_async:
+        # pylint: disable=import-outside-toplevel
+        import async_server
+
+        app = async_server.AsyncApp(PUBLIC_KEY, register_user, check_request_signature, POI_INDEX,
+                                    register_users=register_users, max_register_batch=MAX_REGISTER_BATCH,
+                                    max_poi_batch=MAX_POI_BATCH, max_body=MAX_BODY_SIZE)
+        async_server.serve(app, host, port)
+        return
+
+    # The reloader runs this function in a parent process that does not serve
+    # requests, and would start its own idle worker processes and pool.
+    APP.run(host=host, port=port, debug=True, use_reloader=WORKER_POOL is None and SERVER.issuance_pool is None)
+
+
+def shutdown():
+    """Stop the batch verifier, the worker pool and the producer of the issuance pool."""
+    # pylint: disable=global-statement
+    global WORKER_POOL
+
+    if BATCH_VERIFIER is not None:
+        BATCH_VERIFIER.close()
+
+    if WORKER_POOL is not None:
+        WORKER_POOL.close()
+        WORKER_POOL = None
+
+    if SERVER is not None and SERVER.issuance_pool is not None:
+        SERVER.issuance_pool.close()
+
+
+class BatchVerifier:
+    """Verify the request signatures of concurrent requests together.
+
+    Requests are queued, and a collector thread gathers them for at most
+    `window` seconds (or `max_batch` requests) after the first one arrives.
+    It then starts checking them with `submit_batch`, which behaves as
+    Server.check_request_signatures_batch with the server key but returns a
+    future, and goes on collecting the next batch: several batches can be
+    verified at once, e.g. by different worker processes.
+    """
+
+    def __init__(self, submit_batch, window=0.005, max_batch=64, timeout=None):
+        self.submit_batch = submit_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.queue = queue.Queue()
+
+        worker = threading.Thread(target=self._run, daemon=True)
+        worker.start()
+
+    def check(self, message, revealed_attributes, signature):
+        """Queue a request signature and wait for its verification.
+
+        Raises:
+            concurrent.futures.TimeoutError: the verification did not
+                complete within the timeout
+        """
+        future = Future()
+        self.queue.put(((message, revealed_attributes, signature), future))
+        return future.result(timeout=self.timeout)
+
+    def close(self):
+        """Stop collecting requests."""
+        self.queue.put(None)
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.queue.put(None)
+                    break
+                batch.append(request)
+
+            try:
+                pending = self.submit_batch([item for item, _ in batch])
+            except Exception as exc:  # pylint: disable=broad-except
+                self._resolve(batch, exc=exc)
+                continue
 
-    APP.run(host=host, port=port, debug=True)
+            pending.add_done_callback(functools.partial(self._resolve, batch))
+
+    @staticmethod
+    def _resolve(batch, pending=None, exc=None):
+        if pending is not None:
+            exc = pending.exception()
+        if exc is not None:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+
+        for (_, future), valid in zip(batch, pending.result()):
+            future.set_result(valid)
+
+
+def check_request_signature(message, attrs_revealed, signature):
+    """Check a request signature, through the batch verifier or the worker pool if enabled."""
+    if BATCH_VERIFIER is not None:
+        return BATCH_VERIFIER.check(message, attrs_revealed, signature)
+
+    if WORKER_POOL is not None:
+        return WORKER_POOL.check_request_signature(message, attrs_revealed, signature)
+
+    return SERVER.check_request_signature(PUBLIC_KEY, message, attrs_revealed, signature)
+
+
+def register_user(issuance_req, username, attributes):
+    """Register a user, through the worker pool if enabled."""
+    if WORKER_POOL is not None:
+        return WORKER_POOL.register(issuance_req, username, attributes)
+
+    return SERVER.register(SECRET_KEY, issuance_req, username, attributes)
+
+
+def register_users(items):
+    """Register many users, in the worker pool if enabled."""
+    if WORKER_POOL is not None:
+        return WORKER_POOL.register_many(items)
+
+    return SERVER.register_many(SECRET_KEY, items)
+
+
+# Maximal number of registrations in a /register-batch request.
+MAX_REGISTER_BATCH = 1024
+
+# Maximal size of a request body, enough for MAX_REGISTER_BATCH registrations.
+MAX_BODY_SIZE = MAX_REGISTER_BATCH * 16 * 1024
+
+# Maximal number of PoIs of a /pois request.
+MAX_POI_BATCH = 256
+
+# Errors of an overloaded worker pool, answered with 503.
+BUSY_ERRORS = (PoolBusyError, FutureTimeoutError)
 
 
 APP = Flask(__name__)
@@ -159,6 +446,7 @@ class PoI(DB.Model):
 
 APP.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///fingerprint.db"
 APP.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+APP.config["MAX_CONTENT_LENGTH"] = MAX_BODY_SIZE
 DB.app = APP
 DB.init_app(APP)
 
@@ -166,6 +454,9 @@ DB.init_app(APP)
 PUBLIC_KEY = None
 SECRET_KEY = None
 SERVER = None
+BATCH_VERIFIER = None
+WORKER_POOL = None
+POI_INDEX = None
 
 
 @APP.route("/public-key", methods=["GET"])
@@ -174,36 +465,93 @@ def get_public_key():
     return PUBLIC_KEY, 200
 
 
+@APP.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Export the phase timings in the Prometheus text format, if enabled."""
+    if not METRICS.enabled:
+        return "Not found", 404
+
+    return METRICS.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
 @APP.route("/register", methods=["POST"])
+@METRICS.instrument("register")
 def register():
     """Handle registrations."""
     username = request.args.get("username")
     attributes = request.args.get("attributes")
     issuance_req = request.args.get("issuance_req")
-    anon_cred = SERVER.register(SECRET_KEY, issuance_req, username, attributes)
+    if None in (username, attributes, issuance_req):
+        return "Bad request", 400
+
+    try:
+        anon_cred = register_user(issuance_req, username, attributes)
+    except BUSY_ERRORS:
+        return "Server busy", 503
 
     res = make_response(anon_cred)
     return res
 
 
+@APP.route("/register-batch", methods=["POST"])
+@METRICS.instrument("register-batch")
+def register_batch():
+    """Handle many registrations at once.
+
+    The body is a JSON object with a "requests" list, each with the
+    "username", "attributes" and "issuance_req" of /register. The answer has
+    a "responses" list in the same order, with the "response" of each
+    registration, or an "error" when it failed.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("requests"), list):
+        return "Bad request", 400
+    if len(body["requests"]) > MAX_REGISTER_BATCH:
+        return "Too many registrations", 413
+
+    try:
+        items = [(req["issuance_req"], req["username"], req["attributes"]) for req in body["requests"]]
+    except (KeyError, TypeError):
+        return "Bad request", 400
+
+    try:
+        anon_creds = register_users(items)
+    except BUSY_ERRORS:
+        return "Server busy", 503
+
+    responses = []
+    for anon_cred in anon_creds:
+        if anon_cred:
+            responses.append({"response": anon_cred.decode("utf-8")})
+        else:
+            responses.append({"error": "Registration failed"})
+
+    return jsonify({"responses": responses})
+
+
 def convert_loc_to_gridval(loc):
     """Placeholder function. Final function would convert the location to a grid value."""
     return int(loc)
 
 
 @APP.route("/poi-loc", methods=["GET"])
+@METRICS.instrument("poi-loc")
 def get_poi_loc():
     """Takes in a latitude and longitude as input, returns a list of associated POIs."""
 
-    lat = float(request.args.get("lat"))
-    lon = float(request.args.get("lon"))
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
     attrs_revealed = request.args.get("attrs_revealed")
     signature = request.args.get("signature")
+    if None in (lat, lon, attrs_revealed, signature):
+        return "Bad request", 400
+
     message = ("{},{}".format(lat, lon)).encode("utf-8")
 
-    valid = SERVER.check_request_signature(
-        PUBLIC_KEY, message, attrs_revealed, signature
-    )
+    try:
+        valid = check_request_signature(message, attrs_revealed, signature)
+    except BUSY_ERRORS:
+        return "Server busy", 503
 
     if not valid:
         return "Invalid signature", 401
@@ -214,13 +562,8 @@ def get_poi_loc():
         cell_x = ((lat - 46.5) / 0.07) * 10
         cell_y = ((lon - 6.55) / 0.1) * 10
         cell_id = int(cell_x + (cell_y * 10))
-        records = PoI.query.filter_by(grid_id=cell_id).all()
-
-        if records:
-            poi_list = [record.to_dict()["poi_id"] for record in records]
-            poi_list_res = {"poi_list": poi_list}
-        else:
-            poi_list_res = {"poi_list": []}
+        with METRICS.phase("db"):
+            poi_list_res = {"poi_list": POI_INDEX.poi_ids(cell_id)}
     else:
         poi_list_res = {"poi_list": []}
 
@@ -228,25 +571,30 @@ def get_poi_loc():
 
 
 @APP.route("/poi-grid", methods=["GET"])
+@METRICS.instrument("poi-grid")
 def get_poi_list():
     """Takes in a cell ID as input, returns a list of associated POIs."""
 
-    cell_id = int(request.args.get("cell_id"))
+    cell_id = request.args.get("cell_id", type=int)
     attrs_revealed = request.args.get("attrs_revealed")
     signature = request.args.get("signature")
+    if None in (cell_id, attrs_revealed, signature):
+        return "Bad request", 400
+
     message = ("{}".format(cell_id)).encode("utf-8")
 
-    valid = SERVER.check_request_signature(
-        PUBLIC_KEY, message, attrs_revealed, signature
-    )
+    try:
+        valid = check_request_signature(message, attrs_revealed, signature)
+    except BUSY_ERRORS:
+        return "Server busy", 503
 
     if not valid:
         return "Invalid signature", 401
 
-    records = PoI.query.filter_by(grid_id=cell_id).all()
+    with METRICS.phase("db"):
+        poi_list = POI_INDEX.poi_ids(cell_id)
 
-    if records:
-        poi_list = [record.to_dict()["poi_id"] for record in records]
+    if poi_list:
         poi_list_res = {"poi_list": poi_list}
 
     else:
@@ -256,6 +604,7 @@ def get_poi_list():
 
 
 @APP.route("/poi", methods=["GET"])
+@METRICS.instrument("poi")
 def get_poi_info():
     """Takes in a PoI ID as input, returns information about that PoI.
     We have a paramter 'noise_factor' for tuning.
@@ -264,14 +613,15 @@ def get_poi_info():
     the noise code, this is used to simulate slight variations in traces
     from the server."""
 
-    poi_id = request.args.get('poi_id')
-    noise_factor = 10
+    poi_id = request.args.get('poi_id', type=int)
+    if poi_id is None:
+        return "Bad request", 400
 
-    records = PoI.query.filter_by(poi_id=int(poi_id)).all()
-    if records:
-        poi_info = records[0].to_dict()
-        poi_info["poi_ratings"] = json.loads(poi_info["poi_ratings"])
+    noise_factor = 10
 
+    with METRICS.phase("db"):
+        poi_info = POI_INDEX.poi(poi_id)
+    if poi_info is not None:
         random_length = random.randint(0, noise_factor)
         padding = [-1 for x in range(0, random_length)]
         poi_info["padding"] = padding
@@ -282,5 +632,37 @@ def get_poi_info():
     return jsonify(poi_info)
 
 
+@APP.route("/pois", methods=["GET"])
+@METRICS.instrument("pois")
+def get_pois_info():
+    """Takes in a comma-separated list of PoI IDs as input, returns information
+    about all these PoIs, in the same order.
+    Every record is padded independently, with the same noise as in
+    get_poi_info, so that a batch looks like the concatenation of as many
+    /poi responses. The record of a PoI that does not exist is null, and at
+    most MAX_POI_BATCH PoIs can be requested at once."""
+
+    try:
+        poi_ids = [int(poi_id) for poi_id in request.args.get("poi_ids", "").split(",")]
+    except ValueError:
+        return "Bad request", 400
+    if len(poi_ids) > MAX_POI_BATCH:
+        return "Too many PoIs", 413
+
+    noise_factor = 10
+
+    pois = []
+    for poi_id in poi_ids:
+        with METRICS.phase("db"):
+            poi_info = POI_INDEX.poi(poi_id)
+        if poi_info is not None:
+            random_length = random.randint(0, noise_factor)
+            padding = [-1 for x in range(0, random_length)]
+            poi_info["padding"] = padding
+        pois.append(poi_info)
+
+    return jsonify({"pois": pois})
+
+
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -1,5 +1,27 @@
 from your_code import Server, Client
 from serialization import jsonpickle
+from keys import KeyContext, RevealedProductCache
+import wire
+from multiexp import multiexp, pippenger
+from petrelic.multiplicative.pairing import G1, G2
+from crypto import GeneralizedSchnorrProof, Transcript
+import hashlib
+from petrelic.bn import Bn
+from poi_index import PoIIndex
+import harness
+from metrics import METRICS
+from opcount import count_operations
+from workers import CryptoWorkerPool, PoolBusyError
+import async_server
+import client as client_cli
+import server as server_cli
+from loadgen import create_poi_database
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from urllib.parse import quote
 import pytest
 
 
@@ -105,3 +127,700 @@ def test_invalid_attributes_from_server():
     with pytest.raises(ValueError) as e:
         assert client.proceed_registration_response(server_pk, issuance_response, client_private_state)
     assert str(e.value) == "received credentials are not valid"
+
+
+def test_key_context_is_shared():
+    """"
+    The context loaded from both serialized keys is reused for the public key and the secret key, and decoding is
+    not repeated across calls.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa")
+    ctx = KeyContext.load(server_pk, server_sk)
+
+    assert KeyContext.from_public_key(server_pk) is ctx
+    assert KeyContext.from_secret_key(server_sk) is ctx
+    assert KeyContext.from_secret_key(server_sk).pk is ctx.pk
+
+
+@pytest.mark.parametrize("fold_pairings", [True, False])
+def test_verification_modes_agree(fold_pairings):
+    """"
+    Both verification modes accept the same request signatures and reject a signature on another message.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server(fold_pairings=fold_pairings)
+    client = Client()
+
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    client_msg = "46.52345,6.5789".encode("utf-8")
+    sig = client.sign_request(server_pk, client_anon_cred, client_msg, "gym,bars")
+
+    assert server.check_request_signature(server_pk, client_msg, "gym,bars", sig)
+    assert not server.check_request_signature(server_pk, client_msg, "gym", sig)
+    assert not server.check_request_signature(server_pk, "46.5,6.5".encode("utf-8"), "gym,bars", sig)
+
+
+@pytest.mark.parametrize("nbr_bases", [2, 3, 5, 40])
+def test_multiexp(nbr_bases):
+    """"
+    multiexp agrees with one exponentiation per base, including zero and unit exponents and a single remaining base.
+    """
+    bases = [G1.generator() ** G1.order().random() for _ in range(nbr_bases)]
+    exps = [G1.order().random() for _ in range(nbr_bases)]
+    exps[0] = 0
+    exps[-1] = 1
+
+    expected = G1.neutral_element()
+    for base, exp in zip(bases, exps):
+        expected = expected * base ** exp
+
+    assert multiexp(G1, bases, exps) == expected
+    assert pippenger(bases[1:], [int(e) for e in exps[1:]]) == expected
+
+
+def test_fixed_base_tables():
+    """"
+    A run with fixed-base tables attached to the server key is accepted, and the tables agree with plain
+    exponentiation.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    ctx = KeyContext.load(server_pk, server_sk)
+    tables = ctx.enable_tables(3)
+    server = Server()
+    client = Client()
+
+    exp = G1.order().random()
+    assert tables.Y1[2].pow(exp) == ctx.pk.Y1[2] ** exp
+    assert tables.footprint()["G2"]["elements"] == 7 * tables.Y2[0].nb_elements()
+
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    client_msg = "46.52345,6.5789".encode("utf-8")
+    sig = client.sign_request(server_pk, client_anon_cred, client_msg, "gym")
+    assert server.check_request_signature(server_pk, client_msg, "gym", sig)
+    assert b"tables" not in jsonpickle.encode(ctx.pk).encode("utf-8")
+
+
+@pytest.mark.parametrize("nbr_requests", [3, 9])
+def test_batch_verification(nbr_requests):
+    """"
+    Batch verification accepts valid request signatures and locates the invalid ones.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    items = []
+    for i in range(nbr_requests):
+        client_msg = "{}".format(i).encode("utf-8")
+        revealed = "gym" if i % 2 else "bars"
+        items.append((client_msg, revealed, client.sign_request(server_pk, client_anon_cred, client_msg, revealed)))
+
+    with count_operations() as ops:
+        assert server.check_request_signatures_batch(server_pk, items) == [True] * nbr_requests
+
+    # Parsing costs len(Y2) + 3 pairings per item; small batches then cost one pairing per item, and larger ones
+    # len(Y2) + 2 pairings in total.
+    nbr_y2 = len(wire.loads(server_pk).Y2)
+    verify_pairings = nbr_y2 + 2 if nbr_requests >= Server.min_batch_size(wire.loads(server_pk)) else nbr_requests
+    assert ops["pairings"] == nbr_requests * (nbr_y2 + 3) + verify_pairings
+
+    items[1] = (items[1][0], "spa", items[1][2])
+    items[-1] = ("forged".encode("utf-8"), items[-1][1], items[-1][2])
+    expected = [True] * nbr_requests
+    expected[1] = expected[-1] = False
+    assert server.check_request_signatures_batch(server_pk, items) == expected
+
+
+def test_batch_verification_malformed():
+    """"
+    A request signature that raises during verification is reported as invalid without failing the other ones.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    items = []
+    for i in range(5):
+        client_msg = "{}".format(i).encode("utf-8")
+        items.append((client_msg, "gym", client.sign_request(server_pk, client_anon_cred, client_msg, "gym")))
+
+    malformed = wire.loads(items[4][2])
+    malformed.commitment = G1.generator()
+    items[4] = (items[4][0], "gym", wire.dumps(malformed))
+
+    assert server.check_request_signatures_batch(server_pk, items) == [True] * 4 + [False]
+
+
+def test_binary_codec():
+    """"
+    A run where the server and the client use the binary codec, and where the server answers a client using the
+    JSON encoding.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars", codec=wire.BINARY)
+    server = Server(codec=wire.BINARY)
+    client = Client(codec=wire.BINARY)
+
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    client_msg = "46.52345,6.5789".encode("utf-8")
+    sig = client.sign_request(server_pk, client_anon_cred, client_msg, "gym")
+    assert server.check_request_signature(server_pk, client_msg, "gym", sig)
+
+    json_sig = Client().sign_request(server_pk, client_anon_cred, client_msg, "gym")
+    assert server.check_request_signature(server_pk, client_msg, "gym", json_sig)
+    assert len(sig) < len(json_sig)
+
+    cred = wire.loads(client_anon_cred)
+    assert wire.decode(wire.encode(cred)).attributes == cred.attributes
+    with pytest.raises(wire.WireFormatError):
+        wire.decode(wire.encode(cred)[:-1])
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_presignature_pool(background):
+    """"
+    Request signatures made from a presignature pool, with fixed-base tables, are valid, and a presignature cannot
+    be used twice.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    pool = client.enable_presignatures(server_pk, client_anon_cred, size=2, background=background, table_window=4)
+    assert pool.pk.tables.window == 4
+    for i, revealed in enumerate(["gym", "", "gym,bars"]):
+        client_msg = "{}".format(i).encode("utf-8")
+        sig = client.sign_request(server_pk, client_anon_cred, client_msg, revealed)
+        assert server.check_request_signature(server_pk, client_msg, revealed, sig)
+    pool.close()
+
+    presignature = pool.take()
+    presignature.sign("0".encode("utf-8"), "gym")
+    with pytest.raises(ValueError):
+        presignature.sign("1".encode("utf-8"), "gym")
+
+
+@pytest.mark.parametrize("process", [False, True])
+def test_issuance_pool(process):
+    """"
+    Credentials issued with pairs of the issuance pool are valid, every pair is used once, and taking from an empty
+    pool is counted as a starvation.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+
+    pool = server.enable_issuance_pool(size=4, low_watermark=1, process=process)
+    deadline = time.monotonic() + 10
+    while pool.stats()["depth"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()["depth"] == 4
+
+    sigma1s = set()
+    for i in range(6):
+        issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+        issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+        client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+        sigma1s.add(wire.loads(client_anon_cred).signature.sigma1.to_binary())
+
+        client_msg = "{}".format(i).encode("utf-8")
+        sig = client.sign_request(server_pk, client_anon_cred, client_msg, "gym")
+        assert server.check_request_signature(server_pk, client_msg, "gym", sig)
+    pool.close()
+
+    assert len(sigma1s) == 6
+    stats = pool.stats()
+    assert stats["taken"] == 6
+    assert stats["produced"] + stats["starved"] >= 6
+
+    empty = server.enable_issuance_pool(size=0)
+    u, sig1 = empty.take()
+    assert sig1 == G1.generator() ** u
+    assert empty.stats()["starved"] == 1
+    empty.close()
+
+
+def test_worker_pool():
+    """"
+    Registrations and request signature checks run in the worker processes give the same results as in process.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    client = Client()
+
+    pool = CryptoWorkerPool(server_pk, server_sk, workers=2)
+    try:
+        issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+        issuance_response = pool.register(issuance_request, "bob", "gym,bars")
+        client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+        assert pool.register(issuance_request, "eve", "pool") == b''
+
+        client_msg = "46.52345,6.5789".encode("utf-8")
+        sig = client.sign_request(server_pk, client_anon_cred, client_msg, "gym")
+        assert pool.check_request_signature(client_msg, "gym", sig)
+        assert not pool.check_request_signature(client_msg, "spa", sig)
+    finally:
+        pool.close()
+
+
+def test_batch_verifier_worker_pool():
+    """"
+    Concurrent requests batched by the server are split across the workers, and each gets its own result.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    requests = []
+    for i in range(12):
+        client_msg = f"46.52345,6.5789,{i}".encode("utf-8")
+        sig = client.sign_request(server_pk, client_anon_cred, client_msg, "gym")
+        requests.append((client_msg, "gym" if i % 3 else "spa", sig, bool(i % 3)))
+
+    pool = CryptoWorkerPool(server_pk, server_sk, workers=2)
+    min_batch = Server.min_batch_size(KeyContext.from_public_key(server_pk).pk)
+    assert [len(chunk) for chunk in pool._chunks(list(range(3 * min_batch)), min_batch)] == [
+        -(-3 * min_batch // 2), 3 * min_batch // 2]
+    assert [len(chunk) for chunk in pool._chunks(list(range(min_batch + 1)), min_batch)] == [min_batch + 1]
+
+    verifier = server_cli.BatchVerifier(pool.submit_check_request_signatures_batch, window=0.05, timeout=30)
+    try:
+        async def check_all():
+            return await asyncio.gather(*(
+                asyncio.to_thread(verifier.check, msg, revealed, sig) for msg, revealed, sig, _ in requests))
+
+        assert asyncio.run(check_all()) == [valid for *_, valid in requests]
+    finally:
+        verifier.close()
+        pool.close()
+
+
+def test_transcript_compatibility():
+    """"
+    In compatibility mode, the transcript gives the challenge of the original hashing, also when the bases are
+    absorbed once and copied, and the proof encodes its elements once. Domain separation gives another challenge.
+    """
+    bases = [G1.generator() ** G1.order().random() for _ in range(3)]
+    proof = GeneralizedSchnorrProof(G1, bases, secrets=[G1.order().random() for _ in range(3)])
+    message = "46.52345,6.5789".encode("utf-8")
+
+    m = hashlib.sha256()
+    for base in bases:
+        m.update(base.to_binary())
+    m.update(proof.get_commitment().to_binary())
+    m.update(proof.get_statement().to_binary())
+    m.update(message)
+    expected = Bn.from_hex(m.hexdigest()).mod(G1.order())
+
+    prefix = Transcript.for_bases(bases)
+    assert proof.get_shamir_challenge(message) == expected
+    assert proof.get_shamir_challenge(message, prefix=prefix) == expected
+    # The commitment and the statement were encoded by the first challenge
+    with count_operations() as ops:
+        assert proof.get_shamir_challenge(message, prefix=prefix) == expected
+    assert ops["G1.to_binary"] == 0
+
+    separated = Transcript.for_bases(bases, domain=b"SecretStroll", group_tag=b"G1")
+    assert proof.get_shamir_challenge(message, prefix=separated) != expected
+
+
+def test_attribute_schema():
+    """"
+    Attributes are matched by name and not as substrings of the comma separated list.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,gymnastics,spa")
+    server = Server()
+    client = Client()
+
+    schema = KeyContext.from_public_key(server_pk).pk.attribute_schema()
+    assert schema.mask("gymnastics,spa") == 0b1100
+    assert schema.names_of(schema.mask("spa,gym")) == ["gym", "spa"]
+    with pytest.raises(ValueError):
+        schema.mask("pool")
+
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gymnastics")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gymnastics")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    client_msg = "46.52345,6.5789".encode("utf-8")
+    sig = client.sign_request(server_pk, client_anon_cred, client_msg, "gymnastics")
+    assert server.check_request_signature(server_pk, client_msg, "gymnastics", sig)
+    assert not server.check_request_signature(server_pk, client_msg, "gym", sig)
+
+
+def test_revealed_product_cache():
+    """"
+    The G2 products of revealed attribute sets are cached, and the least recently used set is evicted.
+    """
+    server_pk, _ = Server.generate_ca("gym,spa,restaurant,bars")
+    cache = RevealedProductCache(KeyContext.from_public_key(server_pk).pk, maxsize=2)
+    pk = cache.pk
+
+    product, plan = cache.get(0b00110)
+    assert product == pk.X2 * pk.Y2[1] * pk.Y2[2]
+    assert plan == [1, 2]
+    cache.get(0b00110)
+    cache.get(0)
+    cache.get(0b10000)
+
+    assert cache.stats() == {"hits": 1, "misses": 3, "evictions": 1, "size": 2}
+
+
+def test_poi_index(tmp_path):
+    """"
+    The PoI index serves grid cells and records from memory, and reloads the database file when it changes.
+    """
+    db_path = str(tmp_path / "fingerprint.db")
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE po_i (poi_id INTEGER PRIMARY KEY, poi_name VARCHAR, poi_address VARCHAR, "
+                       "grid_id INTEGER, poi_ratings VARCHAR)")
+    connection.executemany("INSERT INTO po_i VALUES (?, ?, ?, ?, ?)",
+                           [(1, "gym", "rue 1", 7, "[4, 5]"), (2, "spa", "rue 2", 7, "[]"), (3, "bar", "rue 3", 2, "[1]")])
+    connection.commit()
+
+    index = PoIIndex(db_path, check_interval=0)
+    assert index.poi_ids(7) == [1, 2]
+    assert index.poi_ids(2) == [3]
+    assert index.poi_ids(5) == [] and index.poi_ids(1000) == []
+    assert index.poi(1) == {"poi_id": 1, "poi_name": "gym", "poi_address": "rue 1", "grid_id": 7, "poi_ratings": [4, 5]}
+    assert index.poi(4) is None
+
+    index.poi(1)["padding"] = [-1]
+    assert "padding" not in index.poi(1)
+
+    connection.execute("INSERT INTO po_i VALUES (4, 'pool', 'rue 4', 2, ?)", (json.dumps([3]),))
+    connection.commit()
+    connection.close()
+    os.utime(db_path, ns=(0, index.version[0] + 1))
+    assert index.poi_ids(2) == [3, 4]
+
+
+def test_harness_suite():
+    """"
+    The suite measures every method of Server and Client, including the batch methods.
+    """
+    data = harness.run_suite([2], [1], it=2, progress=None, batch_size=3)
+    harness.validate_results(data)
+    names = {result["name"] for result in data["results"]}
+    assert {"Server.register_many", "Server.check_request_signatures_batch", "Client.sign_request"} <= names
+    batch = next(result for result in data["results"] if result["name"] == "Server.check_request_signatures_batch")
+    assert batch["params"] == {"attributes": 2, "revealed": 1, "batch": 3}
+
+
+def test_harness_compare():
+    """"
+    The harness reports percentiles and confidence intervals, and flags the measures whose mean grew significantly.
+    """
+    stats = harness.measure(lambda: sum(range(100)), it=50)
+    assert stats["it"] == 50
+    assert stats["min"] <= stats["median"] <= stats["p99"] <= stats["max"]
+    assert stats["ci95_low"] <= stats["mean"] <= stats["ci95_high"]
+    assert harness.measure(lambda: None, warmup=2, min_time=0.001, max_it=20)["it"] <= 20
+    assert harness.percentile([5, 1, 4, 2, 3], 90) == 5
+    assert harness.percentile(list(range(1, 11)), 90) == 9
+    assert harness.percentile([1, 2, 3, 4], 50) == 2
+
+    def results(mean, std):
+        stats = {"it": 100, "mean": mean, "std": std, "min": mean, "max": mean, "median": mean, "p90": mean,
+                 "p99": mean, "ci95_low": mean - std / 5, "ci95_high": mean + std / 5}
+        return {"schema_version": harness.SCHEMA_VERSION, "metadata": harness.environment_metadata(),
+                "results": [{"name": "Server.register", "params": {"attributes": 5}, "stats": stats}]}
+
+    assert harness.compare_results(results(1.0, 0.1), results(1.5, 0.1))[0]["regression"]
+    assert not harness.compare_results(results(1.0, 0.1), results(1.02, 0.1))[0]["regression"]
+    assert not harness.compare_results(results(1.0, 5.0), results(1.5, 5.0))[0]["regression"]
+    with pytest.raises(ValueError):
+        harness.validate_results({"schema_version": harness.SCHEMA_VERSION, "results": []})
+
+
+def test_metrics():
+    """"
+    Once enabled, the phases of a request are aggregated per endpoint and attribute count, and rendered in the
+    Prometheus text format.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,spa")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,spa")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+    message = "46.52345,6.5789".encode("utf-8")
+    sig = client.sign_request(server_pk, client_anon_cred, message, "gym")
+
+    assert METRICS.render().count("\n") == 2
+    METRICS.enable()
+    try:
+        with METRICS.request("poi-loc"):
+            assert server.check_request_signature(server_pk, message, "gym", sig)
+        with METRICS.request("poi-loc"):
+            assert server.check_request_signature(server_pk, message, "gym", sig)
+        text = METRICS.render()
+    finally:
+        METRICS.disable()
+        METRICS.reset()
+
+    for phase in ["parse", "statement", "challenge", "verify", "total"]:
+        assert 'secretstroll_phase_seconds_count{{endpoint="poi-loc",attributes="1",phase="{}"}} 2'.format(phase) in text
+    assert 'phase="verify",le="+Inf"} 2' in text
+
+
+def test_operation_counts():
+    """"
+    The operation counters give deterministic costs, and the petrelic methods are restored afterwards.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,spa")
+    issuance_response = server.register(server_sk, issuance_request, "bob", "gym,spa")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+    message = "46.52345,6.5789".encode("utf-8")
+    sig = client.sign_request(server_pk, client_anon_cred, message, "gym")
+    pk = KeyContext.from_public_key(server_pk).pk
+
+    g1_pow = type(G1.generator()).__pow__
+    with count_operations() as outer:
+        G1.generator() ** 5
+        with count_operations() as ops:
+            assert server.check_request_signature(server_pk, message, "gym", sig)
+    assert type(G1.generator()).__pow__ is g1_pow
+
+    # e(sigma2, g2), e(sigma1, X2 * Y2[gym]), one base per G2 element, and the folded check
+    assert ops["pairings"] == len(pk.Y2) + 4
+    assert ops["wire.loads"] == 1
+    # The digest of the key, to find its context, and the Fiat-Shamir challenge
+    assert ops["hash.digest"] == 2
+    assert outer["G1.exp"] == ops["G1.exp"] + 1
+    assert outer["pairings"] == ops["pairings"]
+
+
+@pytest.mark.parametrize("nbr_users", [1, 7])
+def test_register_many(nbr_users):
+    """"
+    Batch registration issues the same credentials as register, and reports the invalid items without failing the
+    others.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    server = Server()
+    client = Client()
+
+    items = []
+    states = []
+    for i in range(nbr_users):
+        issuance_request, client_private_state = client.prepare_registration(server_pk, "user{}".format(i), "gym,spa")
+        items.append((issuance_request, "user{}".format(i), "gym,spa"))
+        states.append(client_private_state)
+
+    # A tampered proof, invalid attributes, and malformed items
+    tampered = wire.loads(items[0][0])
+    tampered.responses = [tampered.responses[1], tampered.responses[0]]
+    items.append((wire.dumps(tampered), "mallory", "gym"))
+    items.append((items[0][0], "eve", "pool"))
+    items.append((items[0][0], "eve", None))
+    items.append((server_pk, "eve", "gym"))
+    malformed = wire.loads(items[0][0])
+    malformed.commitment = malformed.commitment.pair(G2.generator())
+    items.append((wire.dumps(malformed), "eve", "gym"))
+
+    responses = server.register_many(server_sk, items)
+    assert len(responses) == nbr_users + 5
+    assert responses[-5:] == [b''] * 5
+
+    message = "46.52345,6.5789".encode("utf-8")
+    for response, state in zip(responses, states):
+        anon_cred = client.proceed_registration_response(server_pk, response, state)
+        sig = client.sign_request(server_pk, anon_cred, message, "spa")
+        assert server.check_request_signature(server_pk, message, "spa", sig)
+
+
+def asgi_request(app, method, path, query="", body=b""):
+    """Serve one request with an ASGI application, and return its status and body."""
+    async def run():
+        sent = []
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "query_string": query.encode("utf-8")}
+        await app(scope, receive, send)
+        return sent[0]["status"], sent[1]["body"]
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def api_apps(tmp_path, monkeypatch):
+    """"
+    The Flask test client and the ASGI application, with a new key and a synthetic database of 50 PoIs in 10 cells.
+    """
+    server_pk, server_sk = Server.generate_ca("gym,spa,restaurant,bars")
+    db_path = str(tmp_path / "fingerprint.db")
+    create_poi_database(db_path, nbr_pois=50, nbr_cells=10)
+    index = PoIIndex(db_path)
+    monkeypatch.setattr(server_cli, "PUBLIC_KEY", server_pk)
+    monkeypatch.setattr(server_cli, "SECRET_KEY", server_sk)
+    monkeypatch.setattr(server_cli, "SERVER", Server())
+    monkeypatch.setattr(server_cli, "POI_INDEX", index)
+
+    app = async_server.AsyncApp(server_pk, server_cli.register_user, server_cli.check_request_signature, index,
+                                register_users=server_cli.register_users,
+                                max_register_batch=server_cli.MAX_REGISTER_BATCH,
+                                max_poi_batch=server_cli.MAX_POI_BATCH, max_body=server_cli.MAX_BODY_SIZE)
+    yield server_cli.APP.test_client(), app, server_pk, server_sk
+    app.executor.shutdown()
+
+
+def test_pois(api_apps):
+    """"
+    /pois answers the records in order, with null for the unknown PoIs, and rejects malformed or too large batches.
+    """
+    flask_client, app, _, _ = api_apps
+
+    res = flask_client.get("/pois", query_string={"poi_ids": "3,1000,1"})
+    assert res.status_code == 200
+    flask_pois = res.get_json()["pois"]
+    status, body = asgi_request(app, "GET", "/pois", "poi_ids=3,1000,1")
+    assert status == 200
+    async_pois = json.loads(body)["pois"]
+
+    for pois in [flask_pois, async_pois]:
+        assert [poi and poi["poi_id"] for poi in pois] == [3, None, 1]
+        assert all(set(padding) <= {-1} for padding in [pois[0]["padding"], pois[2]["padding"]])
+
+    too_many = ",".join(str(poi_id) for poi_id in range(server_cli.MAX_POI_BATCH + 1))
+    for poi_ids, expected in [("", 400), ("a", 400), ("1,,2", 400), (too_many, 413)]:
+        assert flask_client.get("/pois", query_string={"poi_ids": poi_ids}).status_code == expected
+        assert asgi_request(app, "GET", "/pois", "poi_ids=" + poi_ids)[0] == expected
+
+
+class FakeResponse:
+    def __init__(self, status_code, obj=None):
+        self.status_code = status_code
+        self.obj = obj
+
+    def json(self):
+        return self.obj
+
+
+class FakeSession:
+    """"
+    Session answering /poi, and /pois if `batch_endpoint` is set, for the PoIs 1 to 9.
+    """
+    def __init__(self, batch_endpoint):
+        self.batch_endpoint = batch_endpoint
+        self.urls = []
+
+    def get(self, url, params):
+        self.urls.append(url)
+        if url.endswith("/pois"):
+            if not self.batch_endpoint:
+                return FakeResponse(404)
+            pois = [{"poi_id": int(poi_id)} if int(poi_id) < 10 else None for poi_id in params["poi_ids"].split(",")]
+            return FakeResponse(200, {"pois": pois})
+
+        if params["poi_id"] >= 10:
+            return FakeResponse(404)
+        return FakeResponse(200, {"poi_id": params["poi_id"]})
+
+
+@pytest.mark.parametrize("batch_endpoint", [False, True])
+def test_fetch_pois(batch_endpoint):
+    """"
+    The client fetches the PoIs with /pois, falls back to /poi on servers without /pois, and fails on unknown PoIs
+    without falling back.
+    """
+    session = FakeSession(batch_endpoint)
+    pois = client_cli.fetch_pois(session, "host", [3, 1, 2], concurrency=2)
+    assert [poi["poi_id"] for poi in pois] == [3, 1, 2]
+    assert len(session.urls) == (1 if batch_endpoint else 4)
+
+    session = FakeSession(batch_endpoint)
+    with pytest.raises(client_cli.SimpleHTTPError):
+        client_cli.fetch_pois(session, "host", [3, 10, 2])
+    if batch_endpoint:
+        assert session.urls == ["http://host/pois"]
+
+    session = FakeSession(batch_endpoint)
+    poi_ids = [poi_id % 9 + 1 for poi_id in range(client_cli.MAX_POI_BATCH + 1)]
+    assert len(client_cli.fetch_pois(session, "host", poi_ids)) == len(poi_ids)
+    if batch_endpoint:
+        assert len(session.urls) == 2
+
+
+class BusyPool:
+    def check_request_signature(self, message, revealed_attributes, signature):
+        raise PoolBusyError("no worker available")
+
+
+def test_async_app_parity(api_apps, monkeypatch):
+    """"
+    The ASGI application answers the same status codes as the Flask application.
+    """
+    flask_client, app, server_pk, server_sk = api_apps
+    client = Client()
+    issuance_request, client_private_state = client.prepare_registration(server_pk, "bob", "gym,bars")
+    issuance_response = Server().register(server_sk, issuance_request, "bob", "gym,bars")
+    client_anon_cred = client.proceed_registration_response(server_pk, issuance_response, client_private_state)
+
+    def signed(cell_id):
+        sig = client.sign_request(server_pk, client_anon_cred, str(cell_id).encode("utf-8"), "gym")
+        return "cell_id={}&attrs_revealed=gym&signature={}".format(cell_id, quote(sig))
+
+    def statuses(method, path, query="", body=b""):
+        if method == "GET":
+            flask_status = flask_client.get(path, query_string=query).status_code
+        else:
+            flask_status = flask_client.post(path, query_string=query, data=body,
+                                             content_type="application/json").status_code
+        return flask_status, asgi_request(app, method, path, query, body)[0]
+
+    cases = [
+        ("GET", "/public-key", "", b"", 200),
+        ("GET", "/poi-grid", signed(3), b"", 200),
+        ("GET", "/poi-grid", signed(3).replace("cell_id=3", "cell_id=4"), b"", 401),
+        ("GET", "/poi-grid", signed(42), b"", 404),
+        ("GET", "/poi", "poi_id=1000", b"", 404),
+        ("GET", "/unknown", "", b"", 404),
+        ("GET", "/poi", "poi_id=a", b"", 400),
+        ("GET", "/poi-grid", "cell_id=a", b"", 400),
+        ("GET", "/poi-loc", "lat=46.52", b"", 400),
+        ("GET", "/poi-grid", "cell_id=3&attrs_revealed=gym", b"", 400),
+        ("GET", "/pois", "poi_ids=1,a", b"", 400),
+        ("POST", "/register", "username=bob&issuance_req=x", b"", 400),
+        ("POST", "/register-batch", "", b"{", 400),
+        ("POST", "/register-batch", "", b"[]", 400),
+        ("POST", "/register-batch", "", b"x" * 101, 413),
+    ]
+    monkeypatch.setitem(server_cli.APP.config, "MAX_CONTENT_LENGTH", 100)
+    app.max_body = 100
+    for method, path, query, body, expected in cases:
+        assert statuses(method, path, query, body) == (expected, expected), (method, path, query)
+
+    monkeypatch.setattr(server_cli, "WORKER_POOL", BusyPool())
+    assert statuses("GET", "/poi-grid", signed(3)) == (503, 503)
@@ -0,0 +1,290 @@
+"""Compact binary encoding of keys, credentials and messages.
+
+A frame is made of the magic bytes, a version byte, a type tag and the fields
+of the object. Group elements and big numbers are written with the binary
+encodings of petrelic, and every variable-length field is prefixed with its
+length as a 4-byte big-endian integer.
+
+The binary codec can be selected alongside the jsonpickle encoding with
+`dumps`. `loads` recognises both encodings, so a peer accepts either.
+"""
+
+import base64
+import struct
+
+from petrelic.bn import Bn
+from petrelic.multiplicative.pairing import G1Element, G2Element, GTElement
+
+from crypto import PublicKey, SecretKey, Signature, Credential
+from messages import IssuanceRequest, IssuanceResponse, RequestSignature
+from serialization import jsonpickle
+
+JSON = "json"
+BINARY = "binary"
+
+MAGIC = b"SSW"
+VERSION = 1
+
+_LENGTH = struct.Struct(">I")
+
+
+class WireFormatError(ValueError):
+    """The data is not a valid binary frame."""
+
+
+class _Writer:
+    """Append the fields of a frame to a buffer."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def raw(self, data):
+        self.chunks.append(_LENGTH.pack(len(data)))
+        self.chunks.append(data)
+
+    def count(self, n):
+        self.chunks.append(_LENGTH.pack(n))
+
+    def bn(self, value):
+        if not isinstance(value, Bn):
+            value = Bn.from_num(value)
+        self.raw(value.binary() if int(value) else b"")
+
+    def element(self, elem):
+        self.raw(elem.to_binary())
+
+    def string(self, value):
+        self.raw(value.encode("utf-8"))
+
+    def bytes(self):
+        return b"".join(self.chunks)
+
+
+class _Reader:
+    """Read the fields of a frame from a buffer."""
+
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+
+    def count(self):
+        end = self.offset + _LENGTH.size
+        if end > len(self.data):
+            raise WireFormatError("truncated frame")
+        (n,) = _LENGTH.unpack_from(self.data, self.offset)
+        self.offset = end
+        return n
+
+    def raw(self):
+        n = self.count()
+        end = self.offset + n
+        if end > len(self.data):
+            raise WireFormatError("truncated frame")
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def bn(self):
+        chunk = self.raw()
+        return Bn.from_binary(chunk) if chunk else Bn.from_num(0)
+
+    def element(self, cls):
+        return cls.from_binary(self.raw())
+
+    def string(self):
+        return self.raw().decode("utf-8")
+
+    def done(self):
+        if self.offset != len(self.data):
+            raise WireFormatError("trailing bytes in frame")
+
+
+def _write_signature(w, sig):
+    w.element(sig.sigma1)
+    w.element(sig.sigma2)
+
+
+def _read_signature(r):
+    return Signature(r.element(G1Element), r.element(G1Element))
+
+
+def _write_list(w, items, write_item):
+    w.count(len(items))
+    for item in items:
+        write_item(item)
+
+
+def _read_list(r, read_item):
+    return [read_item() for _ in range(r.count())]
+
+
+def _write_public_key(w, pk):
+    w.element(pk.X2)
+    _write_list(w, pk.Y1, w.element)
+    _write_list(w, pk.Y2, w.element)
+    _write_list(w, pk.valid_attributes, w.string)
+
+
+def _read_public_key(r):
+    X2 = r.element(G2Element)
+    Y1 = _read_list(r, lambda: r.element(G1Element))
+    Y2 = _read_list(r, lambda: r.element(G2Element))
+    return PublicKey(X2, Y1, Y2, _read_list(r, r.string))
+
+
+def _write_secret_key(w, sk):
+    w.bn(sk.x)
+    _write_list(w, sk.y, w.bn)
+    _write_list(w, sk.valid_attributes, w.string)
+
+
+def _read_secret_key(r):
+    x = r.bn()
+    y = _read_list(r, r.bn)
+    return SecretKey(x, y, _read_list(r, r.string))
+
+
+def _write_credential(w, cred):
+    w.bn(cred.secret_key)
+    _write_list(w, cred.attributes, w.string)
+    _write_signature(w, cred.signature)
+
+
+def _read_credential(r):
+    secret_key = r.bn()
+    attributes = _read_list(r, r.string)
+    return Credential(secret_key, attributes, _read_signature(r))
+
+
+def _write_issuance_request(w, req):
+    w.element(req.statement)
+    w.element(req.commitment)
+    _write_list(w, req.responses, w.bn)
+
+
+def _read_issuance_request(r):
+    statement = r.element(G1Element)
+    commitment = r.element(G1Element)
+    return IssuanceRequest(statement, commitment, _read_list(r, r.bn))
+
+
+def _write_issuance_response(w, resp):
+    _write_signature(w, resp.credential)
+
+
+def _read_issuance_response(r):
+    return IssuanceResponse(_read_signature(r))
+
+
+def _write_request_signature(w, req):
+    _write_signature(w, req.r_sig)
+    w.element(req.commitment)
+    _write_list(w, req.responses, w.bn)
+
+
+def _read_request_signature(r):
+    r_sig = _read_signature(r)
+    commitment = r.element(GTElement)
+    return RequestSignature(r_sig, commitment, _read_list(r, r.bn))
+
+
+# Type tag, class, writer and reader of every supported type.
+_TYPES = [
+    (1, PublicKey, _write_public_key, _read_public_key),
+    (2, SecretKey, _write_secret_key, _read_secret_key),
+    (3, Signature, _write_signature, _read_signature),
+    (4, Credential, _write_credential, _read_credential),
+    (5, IssuanceRequest, _write_issuance_request, _read_issuance_request),
+    (6, IssuanceResponse, _write_issuance_response, _read_issuance_response),
+    (7, RequestSignature, _write_request_signature, _read_request_signature),
+]
+_WRITERS = {cls: (tag, write) for tag, cls, write, _ in _TYPES}
+_READERS = {tag: read for tag, _, _, read in _TYPES}
+
+
+def encode(obj):
+    """Encode an object in a binary frame.
+
+    Args:
+        obj: a key, a credential, a signature or a message
+
+    Return:
+        byte[]: the binary frame
+    """
+    try:
+        tag, write = _WRITERS[type(obj)]
+    except KeyError:
+        raise TypeError("cannot encode {}".format(type(obj).__name__)) from None
+
+    w = _Writer()
+    w.chunks.append(MAGIC + bytes([VERSION, tag]))
+    write(w, obj)
+    return w.bytes()
+
+
+def decode(data):
+    """Decode a binary frame.
+
+    Args:
+        data (byte[]): the binary frame
+
+    Return:
+        the decoded object
+    """
+    header = len(MAGIC) + 2
+    if len(data) < header or data[:len(MAGIC)] != MAGIC:
+        raise WireFormatError("not a binary frame")
+    if data[len(MAGIC)] != VERSION:
+        raise WireFormatError("unsupported version {}".format(data[len(MAGIC)]))
+
+    read = _READERS.get(data[len(MAGIC) + 1])
+    if read is None:
+        raise WireFormatError("unknown type tag {}".format(data[len(MAGIC) + 1]))
+
+    r = _Reader(data, header)
+    obj = read(r)
+    r.done()
+    return obj
+
+
+def dumps(obj, codec=JSON):
+    """Serialize an object with the given codec.
+
+    The binary frames are base64 encoded (URL-safe alphabet), since the
+    serialized objects travel in query strings and files.
+
+    Args:
+        obj: the object to serialize
+        codec (string): JSON or BINARY
+
+    Return:
+        byte[]: the serialized object
+    """
+    if codec == JSON:
+        return jsonpickle.encode(obj).encode("utf-8")
+    if codec == BINARY:
+        return base64.urlsafe_b64encode(encode(obj))
+    raise ValueError("unknown codec {}".format(codec))
+
+
+def loads(data):
+    """Deserialize an object serialized with any codec.
+
+    Args:
+        data (byte[] or string): the serialized object
+
+    Return:
+        the deserialized object
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    data = data.strip()
+
+    if data.startswith("{"):
+        return jsonpickle.decode(data)
+
+    try:
+        frame = base64.urlsafe_b64decode(data)
+    except ValueError:
+        raise WireFormatError("not a serialized object") from None
+    return decode(frame)
@@ -0,0 +1,221 @@
+"""Process pool running the server cryptography outside the web process.
+
+Every worker process decodes the server keys once, when it starts, and then
+serves Server.register and Server.check_request_signature calls. The number
+of calls waiting for a worker is bounded, and callers give up after a
+timeout, so that a saturated pool sheds load instead of queueing forever.
+"""
+
+import concurrent.futures
+import multiprocessing
+import threading
+
+from keys import KeyContext
+from your_code import Server
+
+# State of a worker process, set by _init_worker.
+_SERVER = None
+_PUBLIC_KEY = None
+_SECRET_KEY = None
+
+
+class PoolBusyError(Exception):
+    """No worker became available before the timeout."""
+
+
+def _init_worker(server_pk, server_sk, table_window, issuance_pool, issuance_low_watermark):
+    # pylint: disable=global-statement
+    global _SERVER
+    global _PUBLIC_KEY
+    global _SECRET_KEY
+
+    _PUBLIC_KEY = server_pk
+    _SECRET_KEY = server_sk
+    ctx = KeyContext.load(server_pk, server_sk)
+    if table_window is not None:
+        ctx.enable_tables(table_window)
+    _SERVER = Server()
+    if issuance_pool is not None:
+        # The workers are daemonic processes, which cannot start a producer
+        # process, so their pools are refilled by a thread.
+        _SERVER.enable_issuance_pool(issuance_pool, issuance_low_watermark, table_window=table_window)
+
+
+def _ready():
+    return _SERVER is not None
+
+
+def _register(issuance_request, username, attributes):
+    return _SERVER.register(_SECRET_KEY, issuance_request, username, attributes)
+
+
+def _register_many(items):
+    return _SERVER.register_many(_SECRET_KEY, items)
+
+
+def _check_request_signature(message, revealed_attributes, signature):
+    return _SERVER.check_request_signature(_PUBLIC_KEY, message, revealed_attributes, signature)
+
+
+def _check_request_signatures_batch(items):
+    return _SERVER.check_request_signatures_batch(_PUBLIC_KEY, items)
+
+
+class CryptoWorkerPool:
+    """Pool of pre-forked processes holding the decoded server keys."""
+
+    def __init__(self, server_pk, server_sk, workers=None, max_pending=None, timeout=5.0, table_window=None,
+                 issuance_pool=None, issuance_low_watermark=None):
+        """Start the worker processes.
+
+        Args:
+            server_pk (byte[]): the server's public key (serialized)
+            server_sk (byte[]): the server's secret key (serialized)
+            workers (int): the number of processes, one per core by default
+            max_pending (int): the maximal number of calls submitted to the
+                pool at once, four per worker by default
+            timeout (float): how long a call waits for a free slot, and then
+                for its result, in seconds
+            table_window (int): if given, the workers precompute fixed-base
+                tables of this window size for the keys
+            issuance_pool (int): if given, every worker keeps this many
+                issuance exponents ready, see Server.enable_issuance_pool
+            issuance_low_watermark (int): the depth under which the issuance
+                pools are refilled
+        """
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending or 4 * self.workers)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(server_pk, server_sk, table_window, issuance_pool, issuance_low_watermark),
+        )
+
+        # Start all the processes now rather than on the first requests.
+        warmup = [self.executor.submit(_ready) for _ in range(self.workers)]
+        concurrent.futures.wait(warmup)
+
+    def _submit(self, fn, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolBusyError("no worker available")
+
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def _call(self, fn, *args):
+        return self._submit(fn, *args).result(timeout=self.timeout)
+
+    def _chunks(self, items, min_chunk=1):
+        """Split items in at most one chunk per worker, of at least
+        min_chunk items unless there are fewer items."""
+        nb_chunks = max(1, min(self.workers, len(items) // max(min_chunk, 1)))
+        size = -(-len(items) // nb_chunks) or 1
+        return [items[start:start + size] for start in range(0, len(items), size)]
+
+    def _submit_chunks(self, fn, items, min_chunk=1):
+        """Submit fn on every chunk of items, and return a future of the
+        concatenated results."""
+        futures = []
+        try:
+            for chunk in self._chunks(items, min_chunk):
+                futures.append(self._submit(fn, chunk))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        return _gather(futures)
+
+    def register(self, issuance_request, username, attributes):
+        """Run Server.register with the pool's secret key in a worker.
+
+        Raises:
+            PoolBusyError: no worker became available in time
+            concurrent.futures.TimeoutError: the call did not complete in time
+        """
+        return self._call(_register, issuance_request, username, attributes)
+
+    def register_many(self, items):
+        """Run Server.register_many with the pool's secret key, with the
+        items split in one chunk per worker.
+
+        Raises:
+            PoolBusyError: no worker became available in time
+            concurrent.futures.TimeoutError: the call did not complete in time
+        """
+        return self._submit_chunks(_register_many, items).result(timeout=self.timeout)
+
+    def check_request_signature(self, message, revealed_attributes, signature):
+        """Run Server.check_request_signature with the pool's public key in a worker.
+
+        Raises:
+            PoolBusyError: no worker became available in time
+            concurrent.futures.TimeoutError: the call did not complete in time
+        """
+        return self._call(_check_request_signature, message, revealed_attributes, signature)
+
+    def check_request_signatures_batch(self, items):
+        """Run Server.check_request_signatures_batch with the pool's public key in a worker.
+
+        Raises:
+            PoolBusyError: no worker became available in time
+            concurrent.futures.TimeoutError: the call did not complete in time
+        """
+        return self._call(_check_request_signatures_batch, items)
+
+    def submit_check_request_signatures_batch(self, items, min_chunk=1):
+        """Start Server.check_request_signatures_batch in the workers, with
+        the items split in one chunk per worker, of at least min_chunk items.
+
+        Args:
+            items ((byte[], string, byte[])[]): the request signatures
+            min_chunk (int): the minimal number of items of a chunk, e.g.
+                Server.min_batch_size so that the chunks are still combined
+
+        Returns:
+            concurrent.futures.Future: the results of all the items, in order
+
+        Raises:
+            PoolBusyError: no worker became available in time
+        """
+        return self._submit_chunks(_check_request_signatures_batch, items, min_chunk)
+
+    def close(self):
+        """Stop the worker processes."""
+        self.executor.shutdown(wait=True)
+
+
+def _gather(futures):
+    """Return a future of the concatenated results of futures of lists."""
+    gathered = concurrent.futures.Future()
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def done(_):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            if remaining:
+                return
+        for future in futures:
+            if future.cancelled():
+                gathered.set_exception(concurrent.futures.CancelledError())
+                return
+            if future.exception() is not None:
+                gathered.set_exception(future.exception())
+                return
+        gathered.set_result([result for future in futures for result in future.result()])
+
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(done)
+    return gathered
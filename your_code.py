@@ -2,25 +2,51 @@
 Classes that you need to complete.
 """
 
+import collections
+import concurrent.futures
+import multiprocessing
+import threading
+
 from petrelic.bn import Bn
-from petrelic.multiplicative.pairing import G1, G2, GT
+from petrelic.multiplicative.pairing import G1, G1Element, G2, GT
 
-import serialization
-from crypto import PublicKey, SecretKey, Signature, Credential, GeneralizedSchnorrProof
+import wire
+from crypto import PublicKey, SecretKey, Signature, Credential, GeneralizedSchnorrProof, generator_table, positions
+from keys import KeyContext, key_digest
+from metrics import METRICS
+from multiexp import multiexp
 from messages import IssuanceResponse, IssuanceRequest, RequestSignature
 
+# Size in bits of the random exponents of batch verification.
+BATCH_SECURITY = 80
+
 
 class Server:
     """Server"""
 
+    def __init__(self, fold_pairings=True, codec=wire.JSON):
+        """Initialize a server.
+
+        Args:
+            fold_pairings (bool): verify request signatures by combining the
+                bases in G2 and pairing once, instead of exponentiating every
+                base in GT
+            codec (string): encoding of the responses, wire.JSON or
+                wire.BINARY. Requests are accepted in both encodings.
+        """
+        self.fold_pairings = fold_pairings
+        self.codec = codec
+        self.issuance_pool = None
+
     @staticmethod
-    def generate_ca(valid_attributes):
+    def generate_ca(valid_attributes, codec=wire.JSON):
         """Initializes the credential system. Runs exactly once in the
         beginning. Decides on schemes public parameters and chooses a secret key
         for the server.
 
         Args:
             valid_attributes (string): comma separated list of attributes
+            codec (string): encoding of the keys, wire.JSON or wire.BINARY
 
         Returns:
             (tuple): tuple containing:
@@ -37,7 +63,7 @@ class Server:
         attr.insert(0, "secret_key")
         sk = SecretKey.generate_random(attr)
         pk = PublicKey.from_secret_key(sk)
-        return serialization.jsonpickle.encode(pk).encode("utf-8"), serialization.jsonpickle.encode(sk).encode("utf-8")
+        return wire.dumps(pk, codec), wire.dumps(sk, codec)
 
     def register(self, server_sk, issuance_request, username, attributes):
         """ Registers a new account on the server.
@@ -55,45 +81,208 @@ class Server:
             with this response.
         """
 
-        sk = serialization.jsonpickle.decode(server_sk.decode("utf-8"))
-        pk = PublicKey.from_secret_key(sk)
-
-        attrs = attributes.split(",")
-
-        # Handle empty attrs list
-        if len(attrs) == 1 and attrs[0] == '':
-            attrs = []
+        with METRICS.phase("parse"):
+            ctx = KeyContext.from_secret_key(server_sk)
+            sk, pk = ctx.sk, ctx.pk
 
-        for attr in attrs:
-            if attr not in sk.valid_attributes:
+            try:
+                held = pk.attribute_schema().mask(attributes)
+            except ValueError:
                 print("attributes are not valid")
                 return b''
 
-        req = serialization.jsonpickle.decode(issuance_request)
+            req = wire.loads(issuance_request)
+            METRICS.label(attributes=bin(held).count("1"))
 
-        bases = [G1.generator(), pk.Y1[0]]
+        with METRICS.phase("statement"):
+            bases = [G1.generator(), pk.Y1[0]]
+            tables = None if pk.tables is None else [pk.tables.g1, pk.tables.Y1[0]]
 
-        proof = GeneralizedSchnorrProof(G1, bases, statement=req.statement, responses=req.responses,
-                                        commitment=req.commitment)
+            proof = GeneralizedSchnorrProof(G1, bases, statement=req.statement, responses=req.responses,
+                                            commitment=req.commitment, tables=tables)
 
-        challenge = proof.get_shamir_challenge()
+        with METRICS.phase("challenge"):
+            challenge = proof.get_shamir_challenge(prefix=ctx.issuance_prefix)
 
-        if not proof.verify(challenge):
+        with METRICS.phase("verify"):
+            valid = proof.verify(challenge)
+        if not valid:
             print("Invalid proof.")
             return b''
 
-        u = G1.order().random()
-        sig1 = G1.generator() ** u
+        with METRICS.phase("sign"):
+            return self._issue(sk, pk, held, req)
+
+    def register_many(self, server_sk, items):
+        """Register many accounts at once.
 
-        sig2 = sk.X * req.statement
-        for i, attr in enumerate(sk.valid_attributes[1:], 1):
-            exp = 1 if attr in attributes else 0
-            sig2 = sig2 * (pk.Y1[i] ** exp)
-        sig2 = sig2 ** u
+        The issuance proofs are checked together as in
+        check_request_signatures_batch: they are combined with small random
+        exponents into one multi-exponentiation in G1, and the batch is split
+        in halves when the combined check fails. An invalid item does not
+        prevent the others from being registered.
+
+        Args:
+            server_sk (byte []): the server's secret key (serialized)
+            items ((bytes[], string, string)[]): the issuance request, the
+                username and the attributes of each account, as given to
+                register
+
+        Return:
+            bytes[][]: the response of each item, as returned by register,
+            or b'' if the item is invalid
+        """
+        ctx = KeyContext.from_secret_key(server_sk)
+        sk, pk = ctx.sk, ctx.pk
+        schema = pk.attribute_schema()
+
+        bases = [G1.generator(), pk.Y1[0]]
+        tables = None if pk.tables is None else [pk.tables.g1, pk.tables.Y1[0]]
+
+        results = [b''] * len(items)
+        proofs = []
+        with METRICS.phase("parse"):
+            for i, (issuance_request, _, attributes) in enumerate(items):
+                try:
+                    if not isinstance(attributes, str):
+                        raise ValueError("attributes must be a string")
+                    held = schema.mask(attributes)
+                except ValueError:
+                    print("attributes are not valid")
+                    continue
+
+                try:
+                    req = wire.loads(issuance_request)
+                    if not isinstance(req, IssuanceRequest):
+                        raise TypeError("not an issuance request")
+                    proof = GeneralizedSchnorrProof(G1, bases, statement=req.statement, responses=req.responses,
+                                                    commitment=req.commitment, tables=tables)
+                except Exception:  # pylint: disable=broad-except
+                    print("Invalid issuance request.")
+                    continue
+
+                proofs.append((i, (held, req, proof)))
+
+        with METRICS.phase("challenge"):
+            entries = []
+            for i, (held, req, proof) in proofs:
+                try:
+                    challenge = proof.get_shamir_challenge(prefix=ctx.issuance_prefix)
+                except Exception:  # pylint: disable=broad-except
+                    continue
+                entries.append((i, (held, req, proof, challenge)))
+
+        with METRICS.phase("verify"):
+            verified = _bisect_batch(entries, self._verify_issuance,
+                                     lambda batch: self._verify_issuance_batch(pk, batch))
+
+        with METRICS.phase("sign"):
+            items_by_index = dict(entries)
+            for i, valid in verified:
+                if not valid:
+                    print("Invalid proof.")
+                    continue
+
+                held, req, _, _ = items_by_index[i]
+                try:
+                    results[i] = self._issue(sk, pk, held, req)
+                except Exception:  # pylint: disable=broad-except
+                    print("Invalid issuance request.")
+
+        return results
+
+    @staticmethod
+    def _verify_issuance(entry):
+        """Check the issuance proof of a parsed entry of register_many."""
+        _, req, proof, challenge = entry
+        return req.responses is not None and proof.verify(challenge)
+
+    @staticmethod
+    def _verify_issuance_batch(pk, entries):
+        """Check many issuance proofs at once.
+
+        With a random delta_j per proof, the product over j of
+        (com_j * statement_j^c_j == g1^r0_j * Y1[0]^r1_j)^delta_j is checked,
+        gathering the exponents of g1 and Y1[0] over all the proofs. A wrong
+        proof makes the combined check pass with probability at most
+        2^-BATCH_SECURITY.
+
+        Args:
+            pk (PublicKey): the server's public key
+            entries: parsed entries of register_many
+
+        Return:
+            Bool: whether all the proofs are correct
+        """
+        if any(req.responses is None or len(req.responses) != 2 for _, req, _, _ in entries):
+            return False
+
+        order = int(G1.order())
+        delta_bound = Bn.from_num(2 ** BATCH_SECURITY)
+        deltas = [int(delta_bound.random()) | 1 for _ in entries]
+
+        left_bases = [req.commitment for _, req, _, _ in entries] + [req.statement for _, req, _, _ in entries]
+        left_exps = deltas + [delta * int(challenge) % order for (_, _, _, challenge), delta in zip(entries, deltas)]
+        left = multiexp(G1, left_bases, left_exps)
+
+        g1_exp = sum(delta * int(req.responses[0]) for (_, req, _, _), delta in zip(entries, deltas)) % order
+        y1_exp = sum(delta * int(req.responses[1]) for (_, req, _, _), delta in zip(entries, deltas)) % order
+        tables = None if pk.tables is None else [pk.tables.g1, pk.tables.Y1[0]]
+        right = multiexp(G1, [G1.generator(), pk.Y1[0]], [g1_exp, y1_exp], tables)
+
+        return left == right
+
+    def _issue(self, sk, pk, held, req):
+        """Sign the statement of a verified issuance request.
+
+        Args:
+            sk (SecretKey): the server's secret key
+            pk (PublicKey): the server's public key
+            held (int): the mask of the attributes of the user
+            req (IssuanceRequest): the issuance request
+
+        Return:
+            response (bytes[]): the serialized issuance response
+        """
+        if self.issuance_pool is not None:
+            u, sig1 = self.issuance_pool.take()
+        else:
+            u = G1.order().random()
+            sig1 = G1.generator() ** u if pk.tables is None else pk.tables.g1.pow(u)
+
+        # sig2 = (X * statement * prod(Y1[held]))^u where X * prod(Y1[held]) is
+        # g1^(x + sum(y[held])), so the held attributes are summed in the
+        # exponent and the cost does not depend on the number of attributes.
+        order = int(G1.order())
+        exp = (int(sk.x) + sum(int(sk.y[i]) for i in positions(held))) * int(u) % order
+        tables = None if pk.tables is None else [pk.tables.g1, None]
+        sig2 = multiexp(G1, [G1.generator(), req.statement], [exp, u], tables)
 
         credential = Signature(sig1, sig2)
         resp = IssuanceResponse(credential)
-        return serialization.jsonpickle.encode(resp).encode("utf-8")
+        return wire.dumps(resp, self.codec)
+
+    def enable_issuance_pool(self, size=64, low_watermark=None, process=False, table_window=None):
+        """Precompute the random exponents u and the first parts g1^u of the
+        issued credentials.
+
+        Once enabled, _issue takes its pair (u, g1^u) from the pool, and only
+        computes the second part of the signature online.
+
+        Args:
+            size (int): the number of pairs kept ready
+            low_watermark (int): the depth under which the pool is refilled
+            process (bool): compute the pairs in a separate process
+            table_window (int): if given, compute g1^u with a fixed-base table
+
+        Returns:
+            IssuancePool: the pool used by the server
+        """
+        if self.issuance_pool is not None:
+            self.issuance_pool.close()
+
+        self.issuance_pool = IssuancePool(size, low_watermark, process, table_window)
+        return self.issuance_pool
 
     def check_request_signature(self, server_pk, message, revealed_attributes, signature):
         """
@@ -109,37 +298,265 @@ class Server:
         Returns:
             valid (boolean): is signature valid
         """
-        server_pk_parsed = serialization.jsonpickle.decode(server_pk.decode('utf-8'))
-        revealed_attributes = revealed_attributes.split(',')
-        if len(revealed_attributes) == 1 and revealed_attributes[0] == '':
-            revealed_attributes = []
+        ctx = KeyContext.from_public_key(server_pk)
+        server_pk_parsed = ctx.pk
+        check = _RequestCheck(server_pk_parsed, message, revealed_attributes, signature, ctx.revealed_cache)
+
+        with METRICS.phase("verify"):
+            if not self.fold_pairings:
+                return check.proof.verify(check.challenge)
+
+            return self._verify_folded(server_pk_parsed, check)
+
+    def check_request_signatures_batch(self, server_pk, items):
+        """Check many request signatures made with the same public key.
+
+        Parsing an item costs len(Y2) + 3 pairings, for the statement and
+        the GT bases of the Fiat-Shamir challenge, as in
+        check_request_signature. The folded relations of the items are then
+        combined with small random exponents and checked with len(Y2) + 2
+        pairings for the whole batch, instead of one pairing and one G2
+        multi-exponentiation per item. Batches of fewer than
+        min_batch_size(pk) items, where this does not pay off, are checked
+        item by item. When the combined check fails, the batch is split in
+        halves until the invalid items are found. A malformed item is
+        reported as invalid.
+
+        Args:
+            server_pk (byte[]): the server's public key (serialized)
+            items ((byte[], string, byte[])[]): the message, the revealed
+                attributes and the signature of each request, as given to
+                check_request_signature
+
+        Returns:
+            Bool[]: whether each signature is valid
+        """
+        ctx = KeyContext.from_public_key(server_pk)
+        pk = ctx.pk
+        results = [False] * len(items)
+        checks = []
+        for i, (message, revealed_attributes, signature) in enumerate(items):
+            try:
+                check = _RequestCheck(pk, message, revealed_attributes, signature, ctx.revealed_cache)
+            except Exception:  # pylint: disable=broad-except
+                continue
+
+            if check.responses_count_ok(pk):
+                checks.append((i, check))
+            else:
+                results[i] = _checked(lambda check: self._verify_folded(pk, check), check)
+
+        verified = _bisect_batch(checks, lambda check: self._verify_folded(pk, check),
+                                 lambda batch: self._verify_batch(pk, batch), min_batch=self.min_batch_size(pk))
+        for i, valid in verified:
+            results[i] = valid
+
+        return results
 
-        req = serialization.jsonpickle.decode(signature)
+    @staticmethod
+    def min_batch_size(pk):
+        """Return the number of request signatures from which a combined
+        check is cheaper than checking them one by one.
+
+        Args:
+            pk (PublicKey): the server's public key
+
+        Return:
+            int: len(pk.Y2) + 2, the number of pairings of a combined check
+        """
+        return len(pk.Y2) + 2
+
+    @staticmethod
+    def _verify_folded(pk, check):
+        """Check the request signature PoK with a single pairing.
+
+        The relation com * statement^c == prod(e(sigma1, B_i)^r_i) is
+        rewritten as com * e(sigma2, g2)^c == e(sigma1, A) where A is the
+        product of g2^r_0, Y2[i]^r_(i+1) and (X2 * prod(Y2[revealed]))^c,
+        computed in G2.
 
-        statement = req.r_sig.sigma2.pair(G2.generator())
-        statement = statement / req.r_sig.sigma1.pair(server_pk_parsed.X2)
-        bases = [req.r_sig.sigma1.pair(G2.generator()), req.r_sig.sigma1.pair(server_pk_parsed.Y2[0])]
+        Args:
+            pk (PublicKey): the server's public key
+            check (_RequestCheck): the parsed request signature
 
-        # Add base for t
+        Return:
+            Bool: whether the proof is correct
+        """
+        req = check.req
+        g2_bases = [G2.generator()] + pk.Y2
+        if req.responses is None or len(req.responses) > len(g2_bases):
+            return False
 
-        # Add base for secret key
+        nb_responses = len(req.responses)
+        tables = None
+        if pk.tables is not None:
+            tables = ([pk.tables.g2] + pk.tables.Y2)[:nb_responses] + [None]
 
-        for i, attr in enumerate(server_pk_parsed.valid_attributes[1:], 1):
-            Yi = server_pk_parsed.Y2[i]
-            if attr in revealed_attributes:
-                statement = statement / req.r_sig.sigma1.pair(Yi)
+        bases = g2_bases[:nb_responses] + [check.revealed_product]
+        exps = list(req.responses) + [check.challenge]
+        acc = multiexp(G2, bases, exps, tables)
 
-            bases.append(req.r_sig.sigma1.pair(Yi))
+        return req.commitment * check.sigma2_pair ** check.challenge == req.r_sig.sigma1.pair(acc)
+
+    @staticmethod
+    def _verify_batch(pk, checks):
+        """Check the folded relations of many requests at once.
+
+        With a random delta_j per request, the product over j of
+        (com_j * e(sigma2_j, g2)^c_j == e(sigma1_j, A_j))^delta_j is checked
+        instead. A wrong request makes the combined check pass with
+        probability at most 2^-BATCH_SECURITY.
+
+        The exponents of the sigma1_j are gathered per G2 base (g2, X2 and
+        Y2[i]), which costs one G1 multi-exponentiation and one pairing per G2
+        base, len(Y2) + 2 pairings in total, plus one GT multi-exponentiation
+        of the commitments.
+
+        Args:
+            pk (PublicKey): the server's public key
+            checks (_RequestCheck[]): parsed request signatures, all with one
+                response per G2 base
 
-        proof = GeneralizedSchnorrProof(GT, bases, statement, responses=req.responses, commitment=req.commitment)
-        c = proof.get_shamir_challenge(message)
+        Return:
+            Bool: whether all the requests are valid
+        """
+        order = int(G1.order())
+        delta_bound = Bn.from_num(2 ** BATCH_SECURITY)
+        deltas = [int(delta_bound.random()) | 1 for _ in checks]
+
+        left = multiexp(GT, [check.req.commitment for check in checks], deltas)
+
+        sigma1s = [check.req.r_sig.sigma1 for check in checks]
+        sigma2s = [check.req.r_sig.sigma2 for check in checks]
+        weighted_challenges = [delta * int(check.challenge) % order for check, delta in zip(checks, deltas)]
+
+        # Exponent of sigma1_j for the base g2, then X2, then every Y2[i];
+        # the sigma2_j are moved to the right-hand side with the base g2.
+        g2_exps = [delta * int(check.req.responses[0]) % order for check, delta in zip(checks, deltas)]
+        negated_challenges = [(order - wc) % order for wc in weighted_challenges]
+        right = multiexp(G1, sigma1s + sigma2s, g2_exps + negated_challenges).pair(G2.generator())
+        right = right * multiexp(G1, sigma1s, weighted_challenges).pair(pk.X2)
+
+        # y_exps[k][j] is the exponent of sigma1_j for the base Y2[k]. The
+        # challenge is added at the revealed positions of the cached plan.
+        y_exps = [[delta * int(check.req.responses[k + 1]) for check, delta in zip(checks, deltas)]
+                  for k in range(len(pk.Y2))]
+        for j, (check, weighted_challenge) in enumerate(zip(checks, weighted_challenges)):
+            for k in check.revealed_positions:
+                y_exps[k][j] += weighted_challenge
+
+        for Yk, exps in zip(pk.Y2, y_exps):
+            right = right * multiexp(G1, sigma1s, [exp % order for exp in exps]).pair(Yk)
+
+        return left == right
+
+
+def _bisect_batch(entries, verify_one, verify_many, min_batch=2):
+    """Find the valid entries of a batch with a combined check.
+
+    The whole batch is checked with verify_many. When that fails, the batch
+    is split in halves until the invalid entries are isolated. Batches of
+    fewer than min_batch entries are checked entry by entry with verify_one.
+
+    Args:
+        entries ((int, object)[]): the index and the value of each entry
+        verify_one (function): checks one value
+        verify_many (function): checks a list of values at once
+        min_batch (int): the size from which verify_many is cheaper than
+            verify_one on every entry
+
+    Return:
+        (int, Bool)[]: the index of each entry and whether it is valid
+    """
+    results = []
+    pending = [entries]
+    while pending:
+        batch = pending.pop()
+        if len(batch) < max(min_batch, 2):
+            results.extend((i, _checked(verify_one, value)) for i, value in batch)
+        elif _checked(verify_many, [value for _, value in batch]):
+            results.extend((i, True) for i, _ in batch)
+        else:
+            half = len(batch) // 2
+            pending.append(batch[half:])
+            pending.append(batch[:half])
+
+    return results
+
+
+def _checked(verify, value):
+    """Run a check, taking an exception (e.g. a group element of the wrong
+    group in a request) as a failed check."""
+    try:
+        return bool(verify(value))
+    except Exception:  # pylint: disable=broad-except
+        return False
+
+
+class _RequestCheck:
+    """A request signature parsed for verification."""
+
+    def __init__(self, pk, message, revealed_attributes, signature, revealed_cache=None):
+        """Parse a request signature and derive its Fiat-Shamir challenge.
 
-        return proof.verify(c)
+        Args:
+            pk (PublicKey): the server's public key
+            message (byte[]): the signed message
+            revealed_attributes (string): revealed attributes
+            signature (bytes[]): user's autorization (serialized)
+            revealed_cache (keys.RevealedProductCache): cache of the G2
+                products of the revealed attribute sets
+        """
+        with METRICS.phase("parse"):
+            self.req = wire.loads(signature)
+            sigma1, sigma2 = self.req.r_sig.sigma1, self.req.r_sig.sigma2
+            self.revealed = pk.attribute_schema().mask(revealed_attributes, strict=False)
+            METRICS.label(attributes=bin(self.revealed).count("1"))
+
+        with METRICS.phase("statement"):
+            # Fold the revealed attributes into X2 so that the statement costs
+            # two pairings whatever the number of revealed attributes.
+            if revealed_cache is not None:
+                self.revealed_product, self.revealed_positions = revealed_cache.get(self.revealed)
+            else:
+                self.revealed_positions = list(positions(self.revealed))
+                self.revealed_product = pk.X2
+                for i in self.revealed_positions:
+                    self.revealed_product = self.revealed_product * pk.Y2[i]
+
+            self.sigma2_pair = sigma2.pair(G2.generator())
+            statement = self.sigma2_pair / sigma1.pair(self.revealed_product)
+
+            # The bases are part of the Fiat-Shamir challenge, hence they are
+            # always needed in GT.
+            bases = [sigma1.pair(G2.generator())]
+            bases.extend(sigma1.pair(Yi) for Yi in pk.Y2)
+
+            self.proof = GeneralizedSchnorrProof(GT, bases, statement, responses=self.req.responses,
+                                                 commitment=self.req.commitment)
+
+        with METRICS.phase("challenge"):
+            self.challenge = self.proof.get_shamir_challenge(message)
+
+    def responses_count_ok(self, pk):
+        """Return whether there is exactly one response per G2 base."""
+        return self.req.responses is not None and len(self.req.responses) == len(pk.Y2) + 1
 
 
 class Client:
     """Client"""
 
+    def __init__(self, codec=wire.JSON):
+        """Initialize a client.
+
+        Args:
+            codec (string): encoding of the requests and credentials,
+                wire.JSON or wire.BINARY. Responses are accepted in both
+                encodings.
+        """
+        self.codec = codec
+        self.presignature_pools = {}
+
     def prepare_registration(self, server_pk, username, attributes):
         """Prepare a request to register a new account on the server.
 
@@ -158,7 +575,7 @@ class Client:
                 You need to design the state yourself.
         """
 
-        server_pk = serialization.jsonpickle.decode(server_pk.decode('utf-8'))
+        server_pk = wire.loads(server_pk)
         secret_key = G1.order().random()
         t = G1.order().random()
 
@@ -173,7 +590,7 @@ class Client:
         statement = proof.get_statement()
 
         req = IssuanceRequest(statement, com, response)
-        req_bytes = serialization.jsonpickle.encode(req).encode('utf-8')
+        req_bytes = wire.dumps(req, self.codec)
 
         # Handle empty attrs list
         attributes = attributes.split(',')
@@ -198,25 +615,22 @@ class Client:
         if server_response == b"":
             raise ValueError("empty response for registration")
 
-        server_pk_parsed = serialization.jsonpickle.decode(
-            server_pk.decode('utf-8'))
+        server_pk_parsed = wire.loads(server_pk)
         (secret_key, attributes, t) = private_state
-        issuance_response = serialization.jsonpickle.decode(
-            server_response.decode('utf-8'))
+        issuance_response = wire.loads(server_response)
         sig = issuance_response.credential
 
         sig_unblind = Signature(sig.sigma1, sig.sigma2 / (sig.sigma1 ** t))
         credential = Credential(secret_key, attributes, sig_unblind)
 
-        messages = [secret_key]
-        for attr in server_pk_parsed.valid_attributes[1:]:
-            m = Bn.from_num(1) if attr in attributes else Bn.from_num(0)
-            messages.append(m)
+        messages = [secret_key] + [Bn.from_num(0)] * (len(server_pk_parsed.Y2) - 1)
+        for i in positions(server_pk_parsed.attribute_schema().mask(attributes, strict=False)):
+            messages[i] = Bn.from_num(1)
 
         if not credential.signature.verify(server_pk_parsed, messages):
             raise ValueError("received credentials are not valid")
 
-        return serialization.jsonpickle.encode(credential).encode('utf-8')
+        return wire.dumps(credential, self.codec)
 
     def sign_request(self, server_pk, credential, message, revealed_info):
         """Signs the request with the clients credential.
@@ -233,42 +647,336 @@ class Client:
             byte []: message's signature (serialized)
         """
 
-        # Parse args
-        server_pk_parsed = serialization.jsonpickle.decode(
-            server_pk.decode('utf-8'))
-        cred = serialization.jsonpickle.decode(credential.decode('utf-8'))
-        revealed_info = revealed_info.split(',')
-        if len(revealed_info) == 1 and revealed_info[0] == '':
-            revealed_info = []
+        pool = self.presignature_pools.get((key_digest(server_pk), key_digest(credential)))
+        if pool is not None:
+            presignature = pool.take()
+        else:
+            presignature = Presignature(wire.loads(server_pk), wire.loads(credential))
+
+        req = presignature.sign(message, revealed_info)
+
+        return wire.dumps(req, self.codec)
+
+    def enable_presignatures(self, server_pk, credential, size=8, background=False, table_window=None):
+        """Precompute the message-independent part of request signatures.
+
+        Once enabled, sign_request consumes the presignatures of the pool for
+        this key and credential, and only hashes the message and computes the
+        responses online.
+
+        Args:
+            server_pk (byte[]): a server's public key (serialized)
+            credential (byte[]): client's credential (serialized)
+            size (int): the number of presignatures kept ready
+            background (bool): refill the pool from a background thread
+            table_window (int): if given, precompute fixed-base tables of
+                this window size for the public key of the pool
+
+        Returns:
+            PresignaturePool: the pool used for this key and credential
+        """
+        key = (key_digest(server_pk), key_digest(credential))
+        previous = self.presignature_pools.pop(key, None)
+        if previous is not None:
+            previous.close()
+
+        pool = PresignaturePool(wire.loads(server_pk), wire.loads(credential), size, background, table_window)
+        self.presignature_pools[key] = pool
+        return pool
+
+
+class Presignature:
+    """Message-independent part of a request signature.
+
+    This holds the randomized credential, the GT bases, the random exponents
+    and the commitment of the PoK. A presignature must be used for one
+    signature only, since reusing the random exponents leaks the secrets.
+    """
+
+    def __init__(self, pk, cred):
+        """Randomize a credential and commit to the random exponents.
+
+        Args:
+            pk (PublicKey): the server's public key
+            cred (Credential): client's credential
+        """
+        self.pk = pk
+        self.cred = cred
+        self.used = False
 
-        # Start PoK
         sig = cred.signature
         r = G1.order().random()
-        t = G1.order().random()
-        cred_randomized = Signature(
-            sig.sigma1 ** r, (sig.sigma2 * sig.sigma1 ** t) ** r)
+        self.t = G1.order().random()
+        self.cred_randomized = Signature(
+            sig.sigma1 ** r, (sig.sigma2 * sig.sigma1 ** self.t) ** r)
+
+        # Base for t, then for the secret key and every attribute
+        sigma1 = self.cred_randomized.sigma1
+        g2_bases = [G2.generator()] + pk.Y2
+        tables = None if pk.tables is None else [pk.tables.g2] + pk.tables.Y2
+
+        # The exponents are combined in G2, so that the commitment and the
+        # statement cost one pairing each instead of a product of GT powers.
+        random_exp = [G1.order().random() for _ in g2_bases]
+        self.commitment = sigma1.pair(multiexp(G2, g2_bases, random_exp, tables))
+
+        # Statement when no attribute is revealed
+        self.held = pk.attribute_schema().mask(cred.attributes, strict=False)
+        held_exps = [self.t, cred.secret_key] + [0] * (len(pk.Y2) - 1)
+        for i in positions(self.held):
+            held_exps[i + 1] = 1
+        self.held_statement = sigma1.pair(multiexp(G2, g2_bases, held_exps, tables))
+
+        # The GT bases are still needed for the Fiat-Shamir challenge, and to
+        # remove the revealed attributes from the statement.
+        self.bases = [sigma1.pair(base) for base in g2_bases]
+
+        self.proof = GeneralizedSchnorrProof(GT, self.bases, statement=self.held_statement,
+                                             commitment=self.commitment)
+        self.proof.random_exp = random_exp
+        self.proof.get_transcript_prefix()
+
+        # The commitment, and the statement when no held attribute is
+        # revealed, are encoded offline too.
+        self.proof.get_encoding(self.commitment)
+        self.proof.get_encoding(self.held_statement)
+
+    def sign(self, message, revealed_info):
+        """Finish the PoK for a message.
 
-        # Begin generalized Schnorr Zk-PoK with Fiat-Shamir heuristic
+        Args:
+            message (byte[]): message to sign
+            revealed_info (string): attributes which need to be authorized
 
-        # Add t
-        bases = [cred_randomized.sigma1.pair(G2.generator())]
-        secrets = [t]
+        Returns:
+            RequestSignature: the signature on the message
+        """
+        if self.used:
+            raise ValueError("a presignature cannot be used twice")
+        self.used = True
 
-        # Add secret key
-        bases.append(cred_randomized.sigma1.pair(server_pk_parsed.Y2[0]))
-        secrets.append(cred.secret_key)
+        revealed = self.pk.attribute_schema().mask(revealed_info, strict=False)
 
-        for i, attr in enumerate(server_pk_parsed.valid_attributes[1:], 1):
-            # Add only if it is a hidden attribute
-            exp = 1 if attr in cred.attributes and attr not in revealed_info else 0
-            bases.append(cred_randomized.sigma1.pair(server_pk_parsed.Y2[i]))
-            secrets.append(exp)
+        # Only the hidden attributes are part of the statement
+        secrets = [self.t, self.cred.secret_key] + [0] * (len(self.pk.Y2) - 1)
+        for i in positions(self.held & ~revealed):
+            secrets[i + 1] = 1
 
-        proof = GeneralizedSchnorrProof(GT, bases, secrets=secrets)
-        com = proof.get_commitment()
-        c = proof.get_shamir_challenge(message)
-        responses = proof.get_responses(c)
+        statement = self.held_statement
+        for i in positions(self.held & revealed):
+            statement = statement / self.bases[i + 1]
+
+        self.proof.statement = statement
+        self.proof.secrets = secrets
+        c = self.proof.get_shamir_challenge(message)
+        responses = self.proof.get_responses(c)
 
-        req = RequestSignature(cred_randomized, com, responses)
+        return RequestSignature(self.cred_randomized, self.commitment, responses)
 
-        return serialization.jsonpickle.encode(req).encode('utf-8')
+
+class PresignaturePool:
+    """Pool of presignatures for one key and credential."""
+
+    def __init__(self, pk, cred, size=8, background=False, table_window=None):
+        """Create a pool and fill it.
+
+        Args:
+            pk (PublicKey): the server's public key
+            cred (Credential): client's credential
+            size (int): the number of presignatures kept ready
+            background (bool): refill the pool from a background thread
+                instead of filling it now
+            table_window (int): if given, precompute fixed-base tables of
+                this window size for pk, before the first presignature
+        """
+        if table_window is not None:
+            pk.precompute(table_window)
+
+        self.pk = pk
+        self.cred = cred
+        self.size = size
+        self.closed = False
+        self.presignatures = collections.deque()
+        self.cond = threading.Condition()
+
+        if background:
+            worker = threading.Thread(target=self._refill, daemon=True)
+            worker.start()
+        else:
+            self.fill()
+
+    def fill(self):
+        """Compute presignatures until the pool is full."""
+        while len(self.presignatures) < self.size:
+            self.presignatures.append(Presignature(self.pk, self.cred))
+
+    def take(self):
+        """Remove a presignature from the pool.
+
+        When the pool is empty, the presignature is computed on the spot.
+
+        Returns:
+            Presignature: a presignature that was never used
+        """
+        with self.cond:
+            presignature = self.presignatures.popleft() if self.presignatures else None
+            self.cond.notify()
+
+        if presignature is None:
+            presignature = Presignature(self.pk, self.cred)
+        return presignature
+
+    def close(self):
+        """Stop the background refill."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _refill(self):
+        while True:
+            with self.cond:
+                while not self.closed and len(self.presignatures) >= self.size:
+                    self.cond.wait()
+                if self.closed:
+                    return
+
+            presignature = Presignature(self.pk, self.cred)
+            with self.cond:
+                self.presignatures.append(presignature)
+
+
+def _issuance_pair(table):
+    u = G1.order().random()
+    return u, G1.generator() ** u if table is None else table.pow(u)
+
+
+def _issuance_pairs(count, table_window):
+    # Runs in the producer process: the pairs cross the pipe in binary form.
+    table = None if table_window is None else generator_table(G1, table_window)
+    pairs = [_issuance_pair(table) for _ in range(count)]
+    return [(u.binary(), sig1.to_binary()) for u, sig1 in pairs]
+
+
+class IssuancePool:
+    """Pool of issuance randomness, pairs (u, g1^u) used by Server._issue.
+
+    The pool is refilled in the background: the producer sleeps while more
+    than `low_watermark` pairs are ready, and then fills the pool up to
+    `size`. A pair is removed from the pool when it is taken, so it is used
+    for one credential only.
+    """
+
+    def __init__(self, size=64, low_watermark=None, process=False, table_window=None):
+        """Create a pool and start its producer.
+
+        Args:
+            size (int): the number of pairs kept ready
+            low_watermark (int): the depth under which the pool is refilled,
+                half of size by default
+            process (bool): compute the pairs in a separate process instead
+                of a thread of this process
+            table_window (int): if given, compute g1^u with a fixed-base table
+                of this window size
+        """
+        self.size = size
+        self.low_watermark = size // 2 if low_watermark is None else low_watermark
+        self.table_window = table_window
+        self.table = None if table_window is None else generator_table(G1, table_window)
+        self.closed = False
+        self.pairs = collections.deque()
+        self.cond = threading.Condition()
+
+        # Counters exported with the depth, see stats
+        self.produced = 0
+        self.taken = 0
+        self.starved = 0
+
+        self.executor = None
+        if process:
+            # The producer is started lazily by the refill thread, in a server
+            # that is already running threads, which a fork could deadlock.
+            # _issuance_pairs only needs this module and returns bytes.
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+        worker = threading.Thread(target=self._refill, daemon=True)
+        worker.start()
+
+    def take(self):
+        """Remove a pair from the pool.
+
+        When the pool is empty, the pair is computed on the spot and counted
+        as a starvation.
+
+        Returns:
+            (Bn, G1Element): a random exponent u and g1^u, never returned before
+        """
+        with self.cond:
+            pair = self.pairs.popleft() if self.pairs else None
+            self.taken += 1
+            if pair is None:
+                self.starved += 1
+            if len(self.pairs) <= self.low_watermark:
+                self.cond.notify()
+
+        if pair is None:
+            pair = _issuance_pair(self.table)
+        return pair
+
+    def stats(self):
+        """Return the depth of the pool and its counters.
+
+        Returns:
+            dict: the depth, size, and the number of pairs produced, taken and
+                taken from an empty pool (starved)
+        """
+        with self.cond:
+            return {
+                "depth": len(self.pairs),
+                "size": self.size,
+                "produced": self.produced,
+                "taken": self.taken,
+                "starved": self.starved,
+            }
+
+    def close(self):
+        """Stop the producer."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def _produce(self, count):
+        if self.executor is None:
+            return [_issuance_pair(self.table) for _ in range(count)]
+
+        pairs = self.executor.submit(_issuance_pairs, count, self.table_window).result()
+        return [(Bn.from_binary(u), G1Element.from_binary(sig1)) for u, sig1 in pairs]
+
+    def _refill(self):
+        while True:
+            with self.cond:
+                while not self.closed and (len(self.pairs) > self.low_watermark or len(self.pairs) >= self.size):
+                    self.cond.wait()
+
+            # Once under the low watermark, fill the pool up to its size. In a
+            # thread, the pairs are added one at a time so that take does not
+            # starve while the pool is being refilled.
+            while True:
+                with self.cond:
+                    if self.closed:
+                        return
+                    missing = self.size - len(self.pairs)
+                if missing <= 0:
+                    break
+
+                try:
+                    pairs = self._produce(missing if self.executor is not None else 1)
+                except RuntimeError:
+                    # The executor was shut down by close.
+                    return
+
+                with self.cond:
+                    self.pairs.extend(pairs)
+                    self.produced += len(pairs)